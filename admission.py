@@ -0,0 +1,275 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, Literal, Optional
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from settings import settings
+
+
+__all__ = ["RouteClass", "ConcurrencyLimit", "OwnerRateLimiter", "AdmissionMiddleware",
+           "classify_request", "retry_after_seconds", "admission_limits",
+           "owner_rate_limiter"]
+
+
+RouteClass = Literal["read", "write", "bulk", "export", "insert"]
+
+# Роуты, которые пишут или читают много строк за запрос
+BULK_ROUTES = {("POST", "/create/employees"), ("POST", "/import/employees"),
+               ("POST", "/import/employees/jobs"), ("DELETE", "/company/employees"),
+               ("POST", "/batch")}
+
+# Выгрузка идет со скоростью клиента и держит место весь ответ, поэтому
+# у нее свой бюджет: медленные выгрузки не задерживают массовые записи
+EXPORT_ROUTES = {("GET", "/export/employees")}
+
+# При склейке вставок запрос только кладет строку в очередь, в бд пишет
+# сама очередь одной транзакцией. Бюджет записи ограничил бы размер
+# пачки, поэтому у таких вставок свой бюджет размером с пачку
+QUEUED_INSERT_ROUTE = ("POST", "/create/employee")
+
+# Служебные роуты не ограничиваются: метрики нужны как раз под нагрузкой
+EXEMPT_PATHS = {"/metrics", "/docs", "/docs/oauth2-redirect", "/redoc", "/openapi.json"}
+
+
+def classify_request(method: str, path: str) -> Optional[RouteClass]:
+    """
+    Класс роута для бюджета параллельных запросов или None, если роут
+    не ограничивается
+
+    method: str
+        HTTP метод
+
+    path: str
+        Путь запроса
+    """
+
+    if path in EXEMPT_PATHS:
+        return None
+
+    if (method, path) in BULK_ROUTES:
+        return "bulk"
+
+    if (method, path) in EXPORT_ROUTES:
+        return "export"
+
+    if (method, path) == QUEUED_INSERT_ROUTE and settings.employee_insert_batching:
+        return "insert"
+
+    return "read" if method in ("GET", "HEAD") else "write"
+
+
+class ConcurrencyLimit:
+    """
+    Бюджет параллельных запросов одного класса роутов: не больше limit
+    выполняются одновременно, еще max_queued ждут своей очереди не
+    дольше timeout секунд, остальные сразу получают отказ
+
+    Ожидающие запросы не держат соединений пула и не ждут блокировку
+    записи SQLite в busy_timeout, поэтому всплеск записей не забирает
+    соединения у чтений
+
+    limit: int
+        Сколько запросов выполняется одновременно
+
+    max_queued: int
+        Сколько запросов может ждать
+
+    timeout: float
+        Сколько секунд запрос ждет в очереди
+    """
+
+    def __init__(self, limit: int, max_queued: int, timeout: float) -> None:
+        self.limit = limit
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.active = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "timeout": 0}
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        "Занимает место, False - отказ (очередь полна или ожидание вышло)"
+
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+
+        if len(self._waiters) >= self.max_queued:
+            self.rejected["queue_full"] += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.done():
+                return True
+            self.rejected["timeout"] += 1
+            return False
+        except asyncio.CancelledError:
+            # Место уже передано этому запросу, но он отменен
+            if waiter.done():
+                self.release()
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+
+    def release(self) -> None:
+        "Освобождает место, передавая его первому ожидающему"
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+
+            if not waiter.done():
+                # active не меняется: место переходит ожидающему
+                waiter.set_result(None)
+                return
+
+        self.active -= 1
+
+    def stats(self) -> Dict[str, int]:
+        "Счетчики для метрик"
+
+        return {"active": self.active, "queued": self.queued, **self.rejected}
+
+
+class OwnerRateLimiter:
+    """
+    Ограничение частоты запросов владельца (token bucket): в среднем не
+    больше rate запросов в секунду, всплеском до burst. Хранятся корзины
+    не больше max_owners владельцев, самые давние вытесняются
+
+    rate: float
+        Запросов в секунду на владельца, 0 - без ограничения
+
+    burst: int
+        Сколько запросов подряд можно сделать без ожидания
+
+    max_owners: int
+        Сколько владельцев помнить
+    """
+
+    def __init__(self, rate: float, burst: int, max_owners: int = 100_000) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_owners = max_owners
+        self.limited = 0
+        self._buckets: OrderedDict[Hashable, tuple[float, float]] = OrderedDict()
+
+    def hit(self, key: Hashable) -> float:
+        """
+        Учитывает запрос владельца. Возвращает 0, если запрос разрешен,
+        иначе через сколько секунд можно повторить
+
+        key: Hashable
+            Ключ владельца (id)
+        """
+
+        if self.rate <= 0:
+            return 0.0
+
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            self.limited += 1
+            wait = (1 - tokens) / self.rate
+
+        self._buckets[key] = (tokens, now)
+
+        while len(self._buckets) > self.max_owners:
+            self._buckets.popitem(last=False)
+
+        return wait
+
+    def clear(self) -> None:
+        self._buckets.clear()
+        self.limited = 0
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware: пропускает запрос к приложению, только если в бюджете
+    его класса роутов (чтение, запись, массовые, выгрузка, склеиваемые
+    вставки) есть место. Когда все
+    места заняты, запрос ждет в ограниченной очереди, а если очередь полна
+    или ожидание вышло - сразу получает 503 с Retry-After
+
+    app: ASGIApp
+        Приложение
+
+    limits: Dict[RouteClass, ConcurrencyLimit]
+        Бюджеты по классам роутов, класс без бюджета не ограничивается
+
+    retry_after: int
+        Значение заголовка Retry-After в секундах
+    """
+
+    def __init__(self, app: ASGIApp, limits: Dict[RouteClass, ConcurrencyLimit],
+                 retry_after: int) -> None:
+        self.app = app
+        self.limits = limits
+        self.retry_after = retry_after
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        route_class = classify_request(scope["method"], scope["path"]) \
+                      if scope["type"] == "http" else None
+        limit = self.limits.get(route_class) if route_class is not None else None
+
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await limit.acquire():
+            response = JSONResponse({"detail": "Сервер перегружен, повторите позже"},
+                                    status_code=503,
+                                    headers={"Retry-After": str(self.retry_after)})
+            await response(scope, receive, send)
+            return
+
+        # Место держится до конца ответа, в том числе потокового
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release()
+
+
+def retry_after_seconds(wait: float) -> str:
+    "Значение Retry-After: целые секунды, не меньше 1"
+
+    return str(max(1, math.ceil(wait)))
+
+
+# Бюджеты процесса, при нескольких воркерах у каждого свои.
+# limit 0 - класс не ограничивается
+admission_limits: Dict[RouteClass, ConcurrencyLimit] = {
+    route_class: ConcurrencyLimit(limit=limit,
+                                  max_queued=settings.admission_queue_size,
+                                  timeout=settings.admission_queue_timeout)
+    for route_class, limit in (("read", settings.admission_read_limit),
+                               ("write", settings.admission_write_limit),
+                               ("bulk", settings.admission_bulk_limit),
+                               ("export", settings.admission_export_limit),
+                               ("insert", settings.admission_insert_limit))
+    if limit > 0}
+
+owner_rate_limiter = OwnerRateLimiter(rate=settings.owner_rate_limit,
+                                      burst=settings.owner_rate_burst)
+
+
+if __name__ == "__main__":
+    pass
@@ -1,14 +1,250 @@
 from sqlalchemy.orm import (
     DeclarativeBase, Mapped, mapped_column, relationship
     )
-from sqlalchemy import ForeignKey, create_engine
-from typing import List
+from sqlalchemy import (
+    DDL, Column, ForeignKey, Index, MetaData, Table, column, create_engine, event, table
+    )
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool, StaticPool
+from settings import Settings, settings
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+
+__all__ = ["Base", "Owner", "Employee", "Company", "EMPLOYEE_COUNT_TRIGGERS",
+           "EMPLOYEE_SEARCH_DDL", "SHARD_EMPLOYEE_COUNT_DDL", "employees_fts",
+           "employee_counts", "shard_metadata", "catalog_tables",
+           "make_engine", "make_async_engine",
+           "get_engine", "get_async_engine", "is_sharded", "shard_of",
+           "get_shard_engine", "get_shard_async_engine",
+           "get_employees_engine", "get_employees_async_engine", "dispose_engines"]
+
+
+def _pool_options(config: Settings, is_async: bool) -> Dict[str, Any]:
+    "Аргументы create_engine для выбранного в настройках класса пула"
+
+    if config.db_pool_class == "null":
+        return {"poolclass": NullPool}
+
+    if config.db_pool_class == "static":
+        return {"poolclass": StaticPool}
+
+    return {"poolclass": AsyncAdaptedQueuePool if is_async else QueuePool,
+            "pool_size": config.db_pool_size,
+            "max_overflow": config.db_max_overflow,
+            "pool_timeout": config.db_pool_timeout,
+            "pool_recycle": config.db_pool_recycle}
+
+
+def _casefold(value: Optional[str]) -> Optional[str]:
+    "SQL функция casefold: LOWER и LIKE в SQLite меняют регистр только у ASCII"
+
+    return value.casefold() if value is not None else None
+
+
+def _listen_sqlite_pragmas(sync_engine: Engine, config: Settings) -> None:
+    """
+    Вешает на движок хук, который выполняет PRAGMA и регистрирует функцию
+    casefold на каждом новом соединении
+
+    sync_engine: Engine
+        Движок (для асинхронного - его sync_engine)
+
+    config: Settings
+        Настройки со значениями PRAGMA
+    """
+
+    if sync_engine.dialect.name != "sqlite":
+        return
+
+    pragmas = [
+        f"PRAGMA journal_mode={config.sqlite_journal_mode}",
+        f"PRAGMA synchronous={config.sqlite_synchronous}",
+        f"PRAGMA busy_timeout={int(config.sqlite_busy_timeout)}",
+        f"PRAGMA cache_size={int(config.sqlite_cache_size)}",
+        f"PRAGMA mmap_size={int(config.sqlite_mmap_size)}",
+        # SQLite по умолчанию не проверяет внешние ключи, без них не
+        # работает ondelete="CASCADE" при удалении компании одним DELETE
+        f"PRAGMA foreign_keys={'ON' if config.sqlite_foreign_keys else 'OFF'}",
+        ]
+
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+        dbapi_connection.create_function("casefold", 1, _casefold, deterministic=True)
+
+
+def make_engine(config: Settings = settings) -> Engine:
+    """
+    Создает синхронный движок по настройкам
+
+    config: Settings
+        Настройки подключения, пула и PRAGMA
+    """
+
+    new_engine = create_engine(config.db_url, **_pool_options(config, is_async=False))
+    _listen_sqlite_pragmas(new_engine, config)
+
+    return new_engine
+
+
+def make_async_engine(config: Settings = settings) -> AsyncEngine:
+    """
+    Создает асинхронный движок по настройкам
+
+    config: Settings
+        Настройки подключения, пула и PRAGMA
+    """
+
+    new_engine = create_async_engine(config.db_async_url,
+                                     **_pool_options(config, is_async=True))
+    _listen_sqlite_pragmas(new_engine.sync_engine, config)
+
+    return new_engine
+
+
+# Движки создаются при первом обращении, а не при импорте: импорт моделей
+# и схем не трогает бд. Приложение создает их на старте в lifespan
+_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+_engine_lock = Lock()
+
+
+def get_engine() -> Engine:
+    "Синхронный движок (схема бд, старый слой work_with_db, бенчмарки)"
+
+    global _engine
+
+    with _engine_lock:
+        if _engine is None:
+            _engine = make_engine()
+
+    return _engine
+
+
+def get_async_engine() -> AsyncEngine:
+    "Асинхронный движок для роутов, работает поверх драйвера aiosqlite"
+
+    global _async_engine
+
+    with _engine_lock:
+        if _async_engine is None:
+            _async_engine = make_async_engine()
+
+    return _async_engine
+
+
+# Движки шардов по номеру шарда, создаются так же лениво
+_shard_engines: Dict[int, Engine] = {}
+_shard_async_engines: Dict[int, AsyncEngine] = {}
+
+
+def is_sharded() -> bool:
+    "Лежат ли сотрудники в шардах, а не в основной бд"
+
+    return settings.db_shards > 0
+
+
+def shard_of(company_id: int) -> int:
+    """
+    Номер шарда, где лежат сотрудники компании
+
+    company_id: int
+        id компании
+    """
 
+    return company_id % settings.db_shards
 
-__all__ = ["Base", "engine", "Owner", "Employee", "Company"]
 
+def _shard_settings(shard: int) -> Settings:
+    "Настройки основной бд с адресом шарда"
 
-engine = create_engine("sqlite+pysqlite:///data_base_biznes.db")
+    return settings.model_copy(update={
+        "db_url": settings.db_shard_url.format(shard=shard),
+        "db_async_url": settings.db_shard_async_url.format(shard=shard)})
+
+
+def get_shard_engine(shard: int) -> Engine:
+    """
+    Синхронный движок шарда (схема бд, старый слой work_with_db)
+
+    shard: int
+        Номер шарда
+    """
+
+    with _engine_lock:
+        if shard not in _shard_engines:
+            _shard_engines[shard] = make_engine(_shard_settings(shard))
+
+    return _shard_engines[shard]
+
+
+def get_shard_async_engine(shard: int) -> AsyncEngine:
+    """
+    Асинхронный движок шарда
+
+    shard: int
+        Номер шарда
+    """
+
+    with _engine_lock:
+        if shard not in _shard_async_engines:
+            _shard_async_engines[shard] = make_async_engine(_shard_settings(shard))
+
+    return _shard_async_engines[shard]
+
+
+def get_employees_engine(company_id: int) -> Engine:
+    """
+    Синхронный движок бд, где лежат сотрудники компании: шард компании
+    или основная бд без шардирования
+
+    company_id: int
+        id компании
+    """
+
+    if is_sharded():
+        return get_shard_engine(shard_of(company_id))
+
+    return get_engine()
+
+
+def get_employees_async_engine(company_id: int) -> AsyncEngine:
+    """
+    Асинхронный движок бд, где лежат сотрудники компании
+
+    company_id: int
+        id компании
+    """
+
+    if is_sharded():
+        return get_shard_async_engine(shard_of(company_id))
+
+    return get_async_engine()
+
+
+async def dispose_engines() -> None:
+    """
+    Закрывает соединения в пулах созданных движков. Сами движки остаются,
+    при следующем запросе пул откроет новые соединения
+    """
+
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
+    if _engine is not None:
+        _engine.dispose()
+
+    for shard_async_engine in list(_shard_async_engines.values()):
+        await shard_async_engine.dispose()
+
+    for shard_engine in list(_shard_engines.values()):
+        shard_engine.dispose()
 
 
 class Base(DeclarativeBase):
@@ -27,6 +263,12 @@ class Owner(Base):
     company: Mapped["Company"] = relationship(back_populates="owner",
                                               single_parent=True,
                                               lazy="selectin")
+
+    @property
+    def company_id(self) -> Optional[int]:
+        "id компании владельца, если она есть"
+
+        return self.company.id if self.company is not None else None
     
     def __repr__(self) -> str:
         answer = f"id: {self.id} " \
@@ -40,19 +282,34 @@ class Company(Base):
     "Таблица Companys (Компании)"
     
     __tablename__ = "Companys"
+    # AUTOINCREMENT: id удаленной компании не достается новой, токены и
+    # кэши со старым company_id не увидят чужих сотрудников
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    name: Mapped[str]
+    name: Mapped[str] = mapped_column(unique=True, index=True)
+    # Уникальный индекс: у владельца может быть только одна компания
     owner_id: Mapped[int] = mapped_column(ForeignKey("Owners.id",
-                                                     onupdate="CASCADE"))
+                                                     onupdate="CASCADE"),
+                                          unique=True,
+                                          index=True)
+    # Количество сотрудников, его ведут триггеры на Employees (см. ниже).
+    # deferred: объекты Company из кэша и обычных запросов его не читают,
+    # чтобы не отдавать устаревшее значение
+    employee_count: Mapped[int] = mapped_column(default=0, server_default="0",
+                                                deferred=True)
 
     owner: Mapped["Owner"] = relationship(back_populates="company",
                                           single_parent=True,
                                           lazy="select")
     
+    # Сотрудники не подгружаются вместе с компанией, список читается
+    # постранично. При удалении компании сотрудников удаляет сама бд
+    # через ondelete="CASCADE", поэтому коллекция не загружается
     employee: Mapped[List["Employee"]] = relationship(back_populates="company",
-                                                      lazy="selectin",
-                                                      cascade="all")
+                                                      lazy="select",
+                                                      cascade="all",
+                                                      passive_deletes=True)
     
     def __repr__(self) -> str:
         answer = f"id: {self.id} " \
@@ -66,13 +323,21 @@ class Employee(Base):
     "Таблица Employees (Сотрудники) "
     
     __tablename__ = "Employees"
+    # Все поиски сотрудников идут внутри компании: составной индекс
+    # для фильтра по company_id + name, индекс по company_id (в SQLite
+    # это фактически company_id + id) для постраничного чтения по id
+    # и каскадного удаления
+    __table_args__ = (
+        Index("ix_Employees_company_id_name", "company_id", "name"),
+        )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str]
     # password: Mapped[str]  для будущей реализации
     company_id: Mapped[int] = mapped_column(ForeignKey("Companys.id",
                                                        onupdate="CASCADE",
-                                                        ondelete="CASCADE" ))
+                                                        ondelete="CASCADE" ),
+                                            index=True)
 
     company: Mapped["Company"] = relationship(back_populates="employee",
                                               single_parent=True,
@@ -86,3 +351,120 @@ class Employee(Base):
         
         return answer
 
+
+# Счетчик Companys.employee_count ведет сама бд: он остается верным для
+# всех путей записи сотрудников (по одному, пачкой, очередью вставок,
+# потоковым импортом) и каскадного удаления, а функции записи не делают
+# лишних запросов. Триггеры создает create_all, в старую бд их
+# добавляет migrate_db
+EMPLOYEE_COUNT_TRIGGERS = [
+    DDL("CREATE TRIGGER IF NOT EXISTS employees_count_insert "
+        "AFTER INSERT ON \"Employees\" BEGIN "
+        "UPDATE \"Companys\" SET employee_count = employee_count + 1 "
+        "WHERE id = NEW.company_id; END"),
+    DDL("CREATE TRIGGER IF NOT EXISTS employees_count_delete "
+        "AFTER DELETE ON \"Employees\" BEGIN "
+        "UPDATE \"Companys\" SET employee_count = employee_count - 1 "
+        "WHERE id = OLD.company_id; END"),
+    # При смене id самой компании (onupdate="CASCADE") счетчик уже
+    # переехал вместе со строкой компании, старого id в Companys нет
+    DDL("CREATE TRIGGER IF NOT EXISTS employees_count_update "
+        "AFTER UPDATE OF company_id ON \"Employees\" "
+        "WHEN NEW.company_id IS NOT OLD.company_id "
+        "AND EXISTS (SELECT 1 FROM \"Companys\" WHERE id = OLD.company_id) BEGIN "
+        "UPDATE \"Companys\" SET employee_count = employee_count - 1 "
+        "WHERE id = OLD.company_id; "
+        "UPDATE \"Companys\" SET employee_count = employee_count + 1 "
+        "WHERE id = NEW.company_id; END"),
+    ]
+
+for _trigger in EMPLOYEE_COUNT_TRIGGERS:
+    event.listen(Employee.__table__, "after_create", _trigger.execute_if(dialect="sqlite"))
+
+
+# Полнотекстовый поиск сотрудников по имени: FTS5 с токенизатором trigram
+# ищет подстроку (от 3 символов) без учета регистра по индексу, а не
+# перебором таблицы. Таблица external content: имена хранятся только в
+# Employees, в FTS - индекс, его синхронизируют триггеры на любой путь
+# записи. company_id UNINDEXED - для фильтра по компании владельца
+EMPLOYEE_SEARCH_DDL = [
+    DDL("CREATE VIRTUAL TABLE IF NOT EXISTS employees_fts USING fts5("
+        "name, company_id UNINDEXED, content='Employees', content_rowid='id', "
+        "tokenize='trigram')"),
+    DDL("CREATE TRIGGER IF NOT EXISTS employees_fts_insert "
+        "AFTER INSERT ON \"Employees\" BEGIN "
+        "INSERT INTO employees_fts(rowid, name, company_id) "
+        "VALUES (NEW.id, NEW.name, NEW.company_id); END"),
+    DDL("CREATE TRIGGER IF NOT EXISTS employees_fts_delete "
+        "AFTER DELETE ON \"Employees\" BEGIN "
+        "INSERT INTO employees_fts(employees_fts, rowid, name, company_id) "
+        "VALUES ('delete', OLD.id, OLD.name, OLD.company_id); END"),
+    DDL("CREATE TRIGGER IF NOT EXISTS employees_fts_update "
+        "AFTER UPDATE OF name, company_id ON \"Employees\" BEGIN "
+        "INSERT INTO employees_fts(employees_fts, rowid, name, company_id) "
+        "VALUES ('delete', OLD.id, OLD.name, OLD.company_id); "
+        "INSERT INTO employees_fts(rowid, name, company_id) "
+        "VALUES (NEW.id, NEW.name, NEW.company_id); END"),
+    ]
+
+for _ddl in EMPLOYEE_SEARCH_DDL:
+    event.listen(Employee.__table__, "after_create", _ddl.execute_if(dialect="sqlite"))
+
+# Индекс без Employees не имеет смысла: удаляется вместе с ней, иначе
+# после пересоздания таблицы в нем остались бы старые rowid
+event.listen(Employee.__table__, "before_drop",
+             DDL("DROP TABLE IF EXISTS employees_fts").execute_if(dialect="sqlite"))
+
+# Описание FTS таблицы для запросов (не модель, create_all ее не создает).
+# rank - встроенная колонка FTS5 с оценкой bm25, меньше - лучше
+employees_fts = table("employees_fts", column("rowid"), column("name"),
+                      column("company_id"), column("rank"))
+
+
+# Схема шарда: та же таблица Employees, но без внешнего ключа на Companys,
+# которой в шарде нет. Проверку компании и удаление ее сотрудников при
+# удалении компании делает work_with_db_async. Поиск (FTS5) живет рядом
+# с Employees в шарде, счетчик сотрудников - в employee_counts шарда
+shard_metadata = MetaData()
+
+_shard_employees = Table(
+    Employee.__tablename__, shard_metadata,
+    *(Column(source.name, source.type, primary_key=source.primary_key,
+             nullable=source.nullable)
+      for source in Employee.__table__.columns),
+    *(Index(index.name, *(source.name for source in index.columns))
+      for index in Employee.__table__.indexes),
+    )
+
+SHARD_EMPLOYEE_COUNT_DDL = [
+    DDL("CREATE TABLE IF NOT EXISTS employee_counts ("
+        "company_id INTEGER PRIMARY KEY, employee_count INTEGER NOT NULL)"),
+    DDL("CREATE TRIGGER IF NOT EXISTS employee_counts_insert "
+        "AFTER INSERT ON \"Employees\" BEGIN "
+        "INSERT INTO employee_counts(company_id, employee_count) "
+        "VALUES (NEW.company_id, 1) ON CONFLICT(company_id) "
+        "DO UPDATE SET employee_count = employee_count + 1; END"),
+    DDL("CREATE TRIGGER IF NOT EXISTS employee_counts_delete "
+        "AFTER DELETE ON \"Employees\" BEGIN "
+        "UPDATE employee_counts SET employee_count = employee_count - 1 "
+        "WHERE company_id = OLD.company_id; END"),
+    ]
+
+for _ddl in SHARD_EMPLOYEE_COUNT_DDL + EMPLOYEE_SEARCH_DDL:
+    event.listen(_shard_employees, "after_create", _ddl.execute_if(dialect="sqlite"))
+
+for _name in ("employees_fts", "employee_counts"):
+    event.listen(_shard_employees, "before_drop",
+                 DDL(f"DROP TABLE IF EXISTS {_name}").execute_if(dialect="sqlite"))
+
+# Счетчик сотрудников компании в шарде
+employee_counts = table("employee_counts", column("company_id"), column("employee_count"))
+
+
+def catalog_tables() -> List[Table]:
+    "Таблицы основной бд: при шардировании без Employees"
+
+    if is_sharded():
+        return [Owner.__table__, Company.__table__] # type: ignore
+
+    return list(Base.metadata.sorted_tables)
@@ -1,13 +1,15 @@
-from pydantic import BaseModel, Field, field_validator
-from .model_db import Owner, engine, Company
-from sqlalchemy.orm import Session
-from sqlalchemy import select
-from fastapi import HTTPException
-from typing import List
-
-__all__ = ["NewOwnerBase", "NewOwnerCreate", "CompanyBase",
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from typing import Annotated, Dict, List, Literal, Optional, Union
+
+__all__ = ["NewOwnerBase", "NewOwnerCreate", "OwnerLogin", "TokenAnswer",
+           "CompanyBase",
            "CompanyCreate", "CompanyAnswer", "CompanyDelete",
-           "EmployeeBase", "EmployeeMany"]
+           "EmployeeNameCount", "CompanySummary",
+           "EmployeeBase", "EmployeeMany", "EmployeeDeleteMany",
+           "EmployeeAnswer", "EmployeeSearchAnswer", "ImportJobAnswer",
+           "BatchCreateEmployee", "BatchCreateEmployees", "BatchDeleteEmployee",
+           "BatchDeleteEmployees", "BatchGetCompany", "BatchGetCompanySummary",
+           "BatchOperation", "BatchRequest", "BatchResult", "BatchAnswer"]
 
 
 ################################# New Owner #################################
@@ -27,28 +29,19 @@ class NewOwnerCreate(NewOwnerBase):
     password: str = Field(min_length=11,
                           max_length=30,
                           examples=["Peshin_Ka_10"])
-    
 
-    @field_validator("name")
-    @classmethod
-    def check_name_in_db(cls, value: str) -> str:
-        """
-        Валидатор для проверки поля 'name'
 
-         value: str
-            значение которое лежит в поле 'name'
-        """
+class OwnerLogin(NewOwnerBase):
+    "Модель для входа владельца по имени и паролю"
 
-        stmt = select(Owner).where(Owner.name == value)
+    password: str = Field(max_length=30)
 
-        with Session(engine) as session:
-            answer_from_db = session.scalar(stmt)
 
-        if answer_from_db is not None:
-            raise HTTPException(status_code=401,
-                                detail="Такой владелец уже существует")
-        
-        return value
+class TokenAnswer(BaseModel):
+    "Модель ответа API с токеном сессии"
+
+    access_token: str
+    token_type: str = "bearer"
 
 
 ################################# Comapny #################################
@@ -63,50 +56,37 @@ class CompanyBase(BaseModel):
 
 class CompanyCreate(CompanyBase):
     "Модель для добавления новой компании от владельца"
-    
-    @field_validator("name")
-    @classmethod
-    def check_name_in_db(cls, value: str) -> str:
-
-        stmt_select = select(Company).where(Company.name == value)
-
-        with Session(engine) as session:
-            answer_from_db = session.scalar(stmt_select)
-
-        if answer_from_db is not None:
-            raise HTTPException(status_code=401,
-                                detail="Такая компания уже существует")
-        
-        return value
 
 
 class CompanyDelete(CompanyBase):
     "Модель для удаления компании"
-
-    @field_validator("name")
-    @classmethod
-    def check_name_in_db(cls, value: str) -> str:
-
-        stmt_select = select(Company).where(Company.name == value)
-
-        with Session(engine) as session:
-            answer_from_db = session.scalar(stmt_select)
-
-        if answer_from_db is None:
-            raise HTTPException(status_code=404,
-                                detail="Такой компании не существует")
-        
-        return value
     
 
 class CompanyAnswer(CompanyBase):
     "Модель ответа API после прочтения ответа из бд"
 
+    # Модель собирается прямо из объекта Company через model_validate
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     owner_id: int
 
-    class Config:
-        orm_mode = True
+
+class EmployeeNameCount(BaseModel):
+    "Имя сотрудника и сколько сотрудников компании с этим именем"
+
+    name: str
+    count: int
+
+
+class CompanySummary(BaseModel):
+    "Модель ответа API со сводкой по сотрудникам компании"
+
+    id: int
+    name: str
+    employee_count: int
+    distinct_names: int
+    top_names: List[EmployeeNameCount]
 
 
 ################################# Employee #################################
@@ -123,5 +103,117 @@ class EmployeeMany(BaseModel):
     array: List[EmployeeBase]
 
 
+class EmployeeDeleteMany(BaseModel):
+    "Модель для множественного удаления сотрудников по именам и/или id"
+
+    names: List[str] = Field(default=[], max_length=10_000)
+    ids: List[int] = Field(default=[], max_length=10_000)
+
+    @model_validator(mode="after")
+    def check_not_empty(self) -> "EmployeeDeleteMany":
+        if not self.names and not self.ids:
+            raise ValueError("Нужно передать names или ids")
+
+        return self
+
+
+class EmployeeAnswer(BaseModel):
+    "Модель сотрудника в ответе API"
+
+    id: int
+    name: str
+
+
+class EmployeeSearchAnswer(BaseModel):
+    "Модель ответа API с найденными сотрудниками, лучшие совпадения первыми"
+
+    items: List[EmployeeAnswer]
+
+
+class ImportJobAnswer(BaseModel):
+    "Модель ответа API со статусом и прогрессом фонового импорта"
+
+    # Модель собирается прямо из задачи ImportJob через model_validate
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    status: Literal["queued", "running", "done", "failed"]
+    total: int
+    rows_done: int
+    rows_failed: int
+    rows_per_s: float
+    error: Optional[str]
+
+
+################################# Batch #################################
+
+
+class BatchCreateEmployee(EmployeeBase):
+    "Операция пакета: добавить сотрудника (как POST /create/employee)"
+
+    op: Literal["create_employee"]
+
+
+class BatchCreateEmployees(EmployeeMany):
+    "Операция пакета: добавить сотрудников (как POST /create/employees)"
+
+    op: Literal["create_employees"]
+
+
+class BatchDeleteEmployee(EmployeeBase):
+    "Операция пакета: удалить сотрудника (как DELETE /create/employee)"
+
+    op: Literal["delete_employee"]
+
+
+class BatchDeleteEmployees(EmployeeDeleteMany):
+    "Операция пакета: удалить сотрудников (как DELETE /company/employees)"
+
+    op: Literal["delete_employees"]
+
+
+class BatchGetCompany(BaseModel):
+    "Операция пакета: компания владельца (как GET /company/by/owner)"
+
+    op: Literal["get_company"]
+
+
+class BatchGetCompanySummary(BaseModel):
+    "Операция пакета: сводка по компании (как GET /company/summary)"
+
+    op: Literal["get_company_summary"]
+    top: int = Field(default=5, ge=0, le=100)
+
+
+BatchOperation = Annotated[Union[BatchCreateEmployee, BatchCreateEmployees,
+                                 BatchDeleteEmployee, BatchDeleteEmployees,
+                                 BatchGetCompany, BatchGetCompanySummary],
+                           Field(discriminator="op")]
+
+
+class BatchRequest(BaseModel):
+    """
+    Модель пакета операций. atomic - все операции или ни одной,
+    independent - ошибка операции откатывает только ее
+    """
+
+    mode: Literal["atomic", "independent"] = "atomic"
+    operations: List[BatchOperation] = Field(min_length=1, max_length=100)
+
+
+class BatchResult(BaseModel):
+    "Результат одной операции пакета: код как у роута, ответ или ошибка"
+
+    status: int
+    result: Union[CompanyAnswer, CompanySummary, Dict[str, int], None] = None
+    detail: Optional[str] = None
+
+
+class BatchAnswer(BaseModel):
+    "Модель ответа API с результатами операций пакета в том же порядке"
+
+    results: List[BatchResult]
+
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,183 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+from threading import Lock
+from pydantic import BaseModel, ValidationError
+from typing import Dict, Optional, Protocol, Union
+from all_models import Owner
+from settings import settings
+
+
+__all__ = ["BEARER_PREFIX", "TokenOwner", "OwnerIdentity", "RevocationStore",
+           "MemoryRevocationStore", "TokenSigner", "revocation_store",
+           "token_signer"]
+
+
+BEARER_PREFIX = "Bearer "
+
+
+class TokenOwner(BaseModel):
+    """
+    Владелец из проверенного токена. Заменяет Owner из бд там, где нужны
+    только id владельца и id его компании
+    """
+
+    id: int
+    company_id: Optional[int]
+    # Время выдачи и истечения (unix time) и уникальный id токена
+    iat: float
+    exp: float
+    jti: str
+
+
+# Владелец прошедший авторизацию: по паролю (Owner из бд) или по токену
+OwnerIdentity = Union[Owner, TokenOwner]
+
+
+class RevocationStore(Protocol):
+    """
+    Хранилище отозванных токенов. По умолчанию MemoryRevocationStore,
+    при нескольких воркерах его нужно заменить общим (например на Redis),
+    иначе отзыв виден только в своем процессе
+    """
+
+    def revoke_token(self, jti: str, expires_at: float) -> None:
+        "Отзывает один токен до момента его истечения"
+
+    def revoke_owner(self, owner_id: int) -> None:
+        "Отзывает все токены владельца выданные до текущего момента"
+
+    def is_revoked(self, token: TokenOwner) -> bool:
+        "Отозван ли токен"
+
+    def clear(self) -> None:
+        "Очищает хранилище"
+
+
+class MemoryRevocationStore:
+    "Хранилище отозванных токенов в памяти процесса"
+
+    def __init__(self) -> None:
+        self._tokens: Dict[str, float] = {}
+        self._owners: Dict[int, float] = {}
+        self._lock = Lock()
+
+    def revoke_token(self, jti: str, expires_at: float) -> None:
+        with self._lock:
+            self._purge()
+            self._tokens[jti] = expires_at
+
+    def revoke_owner(self, owner_id: int) -> None:
+        with self._lock:
+            self._owners[owner_id] = time.time()
+
+    def is_revoked(self, token: TokenOwner) -> bool:
+        if token.jti in self._tokens:
+            return True
+
+        revoked_at = self._owners.get(token.id)
+
+        return revoked_at is not None and token.iat < revoked_at
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tokens.clear()
+            self._owners.clear()
+
+    def _purge(self) -> None:
+        "Забывает истекшие токены, они и так не пройдут проверку"
+
+        now = time.time()
+        expired = [jti for jti, expires_at in self._tokens.items() if expires_at < now]
+
+        for jti in expired:
+            del self._tokens[jti]
+
+
+def _b64encode(value: bytes) -> str:
+    return base64.urlsafe_b64encode(value).rstrip(b"=").decode()
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+class TokenSigner:
+    """
+    Выпускает и проверяет токены вида <payload>.<подпись>, где payload -
+    JSON с id владельца и компании, а подпись - HMAC-SHA256. Проверка
+    не ходит в бд
+
+    secret_key: str
+        Ключ подписи. Пустая строка - случайный ключ процесса, тогда
+        токены не переживают перезапуск и не работают между воркерами
+
+    ttl: int
+        Время жизни токена в секундах
+
+    store: RevocationStore
+        Хранилище отозванных токенов
+    """
+
+    def __init__(self, secret_key: str, ttl: int, store: RevocationStore) -> None:
+        self._key = secret_key.encode() if secret_key else secrets.token_bytes(32)
+        self.ttl = ttl
+        self.store = store
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self._key, payload.encode(), hashlib.sha256).digest())
+
+    def issue(self, owner_id: int, company_id: Optional[int]) -> str:
+        """
+        Выпускает токен владельцу
+
+        owner_id: int
+            id владельца
+
+        company_id: Optional[int]
+            id компании владельца, если она есть
+        """
+
+        now = time.time()
+        claims = TokenOwner(id=owner_id, company_id=company_id, iat=now,
+                            exp=now + self.ttl, jti=secrets.token_urlsafe(12))
+        payload = _b64encode(claims.model_dump_json().encode())
+
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token: str) -> Optional[TokenOwner]:
+        """
+        Проверяет подпись, срок и отзыв токена. Возвращает владельца
+        из токена или None
+
+        token: str
+            Токен без префикса Bearer
+        """
+
+        payload, _, signature = token.partition(".")
+
+        if not hmac.compare_digest(self._sign(payload).encode(), signature.encode()):
+            return None
+
+        try:
+            claims = TokenOwner.model_validate_json(_b64decode(payload))
+        except (ValueError, ValidationError):
+            return None
+
+        if claims.exp < time.time() or self.store.is_revoked(claims):
+            return None
+
+        return claims
+
+
+revocation_store: RevocationStore = MemoryRevocationStore()
+
+token_signer = TokenSigner(secret_key=settings.auth_secret_key,
+                           ttl=settings.session_token_ttl,
+                           store=revocation_store)
+
+
+if __name__ == "__main__":
+    pass
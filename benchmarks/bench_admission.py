@@ -0,0 +1,70 @@
+"""
+Бенчмарк admission control: всплеск записей (POST /create/employee с
+большой параллельностью) и одновременно чтения (GET /company/summary,
+идет в бд, в отличие от кэшируемого /company/by/owner).
+
+    off - без бюджетов: все записи сразу берут соединения пула и ждут
+          блокировку записи SQLite, чтения ждут свободное соединение
+    on  - бюджеты из настроек (GUDELO_ADMISSION_*): лишние записи ждут
+          в очереди middleware без соединения, при переполнении 503
+
+Для чтений и записей печатает p95/p99, rps и ошибки (вместе с 503).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_admission --writes 3000 --write-concurrency 200
+"""
+
+import argparse
+import asyncio
+
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks.bench_load import auth_headers, run_scenario, seed
+from admission import admission_limits
+from main import app
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--owners", type=int, default=200)
+    parser.add_argument("--employees", type=int, default=50,
+                        help="сотрудников в каждой компании")
+    parser.add_argument("--writes", type=int, default=3000)
+    parser.add_argument("--write-concurrency", type=int, default=200)
+    parser.add_argument("--reads", type=int, default=1000)
+    parser.add_argument("--read-concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    limits = dict(admission_limits)
+
+    def make_write(i: int):
+        return i % args.owners, ("POST", "/create/employee", {"name": f"burst_{i}"})
+
+    def make_read(i: int):
+        return i % args.owners, ("GET", "/company/summary", None)
+
+    for name, enabled in (("off", False), ("on", True)):
+        seed(owners=args.owners, companies=args.owners, employees=args.employees)
+        headers = auth_headers(args.owners, args.owners, mode="token")
+
+        # Middleware держит тот же словарь, пустой - без ограничений
+        admission_limits.clear()
+        if enabled:
+            admission_limits.update(limits)
+
+        async with app.router.lifespan_context(app):
+            # Ошибки бд (database is locked, таймаут пула) считаются ответами 500
+            async with AsyncClient(transport=ASGITransport(app=app, raise_app_exceptions=False),
+                                   base_url="http://bench", timeout=None) as client:
+                writes, reads = await asyncio.gather(
+                    run_scenario(client, headers, make_write, args.writes, args.write_concurrency),
+                    run_scenario(client, headers, make_read, args.reads, args.read_concurrency))
+
+        for kind, result in (("write", writes), ("read", reads)):
+            print(f"{name:<4} {kind:<6} rps={result['rps']:8.1f}  p95={result['p95_ms']:9.1f} ms  "
+                  f"p99={result['p99_ms']:9.1f} ms  errors={result['errors']:.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
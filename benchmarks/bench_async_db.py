@@ -0,0 +1,174 @@
+"""
+Нагрузочный бенчмарк слоя работы с бд: синхронный work_with_db (как было)
+против асинхронного work_with_db_async (как стало).
+
+Оба варианта прогоняются через одинаковые FastAPI роуты в одном процессе
+через ASGI транспорт httpx, параллельно запросам крутится проба которая
+меряет задержку event loop.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_async_db --requests 2000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Путь к бд в движках относительный, поэтому уходим во временную
+# директорию до первого подключения - рабочая бд не затрагивается.
+# Пути из аргументов бенчмарков считаются от START_DIR
+START_DIR = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix="gudelo_bench_"))
+
+from fastapi import FastAPI, Header, Response  # noqa: E402
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+from typing import Annotated, Dict, List  # noqa: E402
+
+import work_with_db  # noqa: E402
+from all_models import (  # noqa: E402
+    get_engine, Owner, Company, Employee, CompanyAnswer, EmployeeBase
+    )
+from hash_fun import hash_password  # noqa: E402
+from main import app as async_app  # noqa: E402
+
+
+PASSWORD = "Peshin_Ka_10"
+
+
+def build_sync_app() -> FastAPI:
+    "Приложение с роутами поверх синхронного слоя, как до перехода на async"
+
+    app = FastAPI()
+
+    @app.get(path="/company/by/owner")
+    async def get_company_by_has_owner(authorization: Annotated[str, Header()]) -> CompanyAnswer:
+        owner = work_with_db.check_owner_in_db(data_owner=authorization)
+        company = work_with_db.get_company_by_owner(data_owner=owner)
+
+        return CompanyAnswer(**company.__dict__) # type: ignore
+
+    @app.post(path="/create/employee")
+    async def add_employee(new_employee: EmployeeBase,
+                           authorization: Annotated[str, Header()]) -> Response:
+        owner = work_with_db.check_owner_in_db(data_owner=authorization)
+        work_with_db.insert_employee_in_db(data_owner=owner, data_employee=new_employee)
+
+        return Response(status_code=201)
+
+    return app
+
+
+def seed(owners: int, employees: int) -> List[str]:
+    """
+    Заполняет бд владельцами с компаниями и сотрудниками
+
+    owners: int
+        Количество владельцев (у каждого одна компания)
+
+    employees: int
+        Количество сотрудников в каждой компании
+
+    return: список заголовков Authorization
+    """
+
+    work_with_db.clear_db()
+    work_with_db.create_db()
+
+    # Один хеш на всех владельцев, чтобы не тратить время на scrypt
+    password = hash_password(PASSWORD)
+    headers = []
+
+    with Session(get_engine()) as session:
+        for i in range(owners):
+            owner = Owner(name=f"owner_{i:05}", password=password)
+            company = Company(name=f"company_{i:05}", owner=owner)
+            company.employee = [Employee(name=f"employee_{i}_{j}")
+                                for j in range(employees)]
+            session.add(owner)
+            headers.append(f"{owner.name}:{PASSWORD}")
+        session.commit()
+
+    return headers
+
+
+async def probe_loop_lag(stop: asyncio.Event, interval: float = 0.001) -> float:
+    "Возвращает максимальную задержку event loop в секундах"
+
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+
+    return worst
+
+
+async def drive(app: FastAPI, route: str, headers: List[str],
+                total: int, concurrency: int) -> Dict[str, float]:
+    "Гоняет total запросов с заданной параллельностью и собирает статистику"
+
+    latencies: List[float] = []
+    counter = iter(range(total))
+    transport = ASGITransport(app=app) # type: ignore
+
+    async with AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def worker() -> None:
+            for i in counter:
+                auth = {"authorization": headers[i % len(headers)]}
+                start = time.perf_counter()
+                if route == "read":
+                    response = await client.get("/company/by/owner", headers=auth)
+                else:
+                    response = await client.post("/create/employee", headers=auth,
+                                                 json={"name": f"bench_{i}"})
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code < 300, response.text
+
+        stop = asyncio.Event()
+        lag = asyncio.create_task(probe_loop_lag(stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        max_lag = await lag
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "max_loop_lag_ms": max_lag * 1000,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--owners", type=int, default=200)
+    parser.add_argument("--employees", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--route", choices=["read", "write"], default="read")
+    args = parser.parse_args()
+
+    headers = seed(owners=args.owners, employees=args.employees)
+
+    for name, app in (("sync (before)", build_sync_app()),
+                      ("async (after)", async_app)):
+        result = await drive(app=app, route=args.route, headers=headers,
+                             total=args.requests, concurrency=args.concurrency)
+        print(f"{name:<15} " + "  ".join(f"{key}={value:.2f}"
+                                         for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
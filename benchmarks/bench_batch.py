@@ -0,0 +1,87 @@
+"""
+Бенчмарк пакета операций: одни и те же операции (добавление сотрудников
+и сводка по компании) отдельными запросами и пакетами POST /batch.
+
+    single - каждая операция отдельным запросом: своя авторизация,
+             своя сессия и свой commit
+    batch  - по --ops операций в одном запросе: одна авторизация и одна
+             транзакция на пакет (режим --mode)
+
+Печатает операций в секунду, p95/p99 запроса и ошибки. С --auth password
+каждый запрос проверяет пароль, и пакет экономит эту проверку на каждой
+операции.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_batch --batches 500 --ops 20 --auth password
+"""
+
+import argparse
+import asyncio
+
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks.bench_load import auth_headers, run_scenario, seed
+from main import app
+
+
+def batch_operation(i: int) -> dict:
+    "i-я операция сценария: каждая пятая - сводка, остальные - добавление"
+
+    if i % 5 == 4:
+        return {"op": "get_company_summary", "top": 5}
+
+    return {"op": "create_employee", "name": f"batch_{i}"}
+
+
+def single_request(operation: dict):
+    "Та же операция отдельным запросом"
+
+    if operation["op"] == "get_company_summary":
+        return "GET", f"/company/summary?top={operation['top']}", None
+
+    return "POST", "/create/employee", {"name": operation["name"]}
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--owners", type=int, default=50)
+    parser.add_argument("--employees", type=int, default=50,
+                        help="сотрудников в каждой компании")
+    parser.add_argument("--batches", type=int, default=500)
+    parser.add_argument("--ops", type=int, default=20, help="операций в пакете")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--mode", choices=("atomic", "independent"), default="atomic")
+    parser.add_argument("--auth", choices=("token", "password"), default="password")
+    args = parser.parse_args()
+
+    def make_single(i: int):
+        owner = i // args.ops % args.owners
+        return owner, single_request(batch_operation(i))
+
+    def make_batch(i: int):
+        operations = [batch_operation(i * args.ops + j) for j in range(args.ops)]
+        return i % args.owners, ("POST", "/batch",
+                                 {"mode": args.mode, "operations": operations})
+
+    scenarios = (("single", make_single, args.batches * args.ops),
+                 ("batch", make_batch, args.batches))
+
+    for name, make_request, total in scenarios:
+        seed(owners=args.owners, companies=args.owners, employees=args.employees)
+        headers = auth_headers(args.owners, args.owners, mode=args.auth)
+
+        async with app.router.lifespan_context(app):
+            async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench",
+                                   timeout=None) as client:
+                result = await run_scenario(client, headers, make_request,
+                                            total, args.concurrency)
+
+        ops_per_s = result["rps"] * args.batches * args.ops / total
+        print(f"{name:<7} ops/s={ops_per_s:8.1f}  rps={result['rps']:8.1f}  "
+              f"p95={result['p95_ms']:8.1f} ms  p99={result['p99_ms']:8.1f} ms  "
+              f"errors={result['errors']:.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
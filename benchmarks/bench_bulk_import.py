@@ -0,0 +1,64 @@
+"""
+Бенчмарк массового добавления сотрудников: JSON тело /create/employees
+против потокового /import/employees в форматах NDJSON и CSV.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_bulk_import --rows 100000 --batch-size 1000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks.bench_async_db import seed
+from main import app
+
+
+async def run(rows: int, batch_size: int) -> None:
+    names = [f"employee_{i}" for i in range(rows)]
+    bodies = {
+        "json /create/employees": (
+            "/create/employees", "application/json",
+            json.dumps({"array": [{"name": name} for name in names]}).encode()),
+        "ndjson /import/employees": (
+            f"/import/employees?batch_size={batch_size}", "application/x-ndjson",
+            "".join(json.dumps({"name": name}) + "\n" for name in names).encode()),
+        "csv /import/employees": (
+            f"/import/employees?batch_size={batch_size}", "text/csv",
+            ("name\n" + "\n".join(names) + "\n").encode()),
+    }
+
+    transport = ASGITransport(app=app) # type: ignore
+
+    async with AsyncClient(transport=transport, base_url="http://bench",
+                           timeout=None) as client:
+        for label, (url, content_type, body) in bodies.items():
+            # Каждый прогон на чистой бд с одним владельцем и компанией
+            authorization = seed(owners=1, employees=0)[0]
+
+            start = time.perf_counter()
+            response = await client.post(url, content=body,
+                                         headers={"authorization": authorization,
+                                                  "content-type": content_type})
+            elapsed = time.perf_counter() - start
+            assert response.status_code == 201, response.text
+
+            print(f"{label:<25} rows={rows}  seconds={elapsed:.2f}  "
+                  f"rows_per_sec={rows / elapsed:,.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    asyncio.run(run(rows=args.rows, batch_size=args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Бенчмарк выгрузки сотрудников компании: время и пиковая память
+(tracemalloc) на сборку всего тела ответа.
+
+    list   - все объекты Employee загружаются списком (scalars().all()),
+             потом форматируются
+    stream - export_employees_by_owner + format_employees, как в
+             GET /export/employees: курсор читается пачками (yield_per)
+
+Тело не собирается в памяти, считаются только его байты, как если бы
+каждый кусок сразу уходил клиенту. Память потока не зависит от числа
+сотрудников, память списка растет вместе с ним.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_export --employees 1000000 --format csv
+"""
+
+import argparse
+import asyncio
+import time
+import tracemalloc
+from typing import AsyncIterator, Callable, List, Tuple
+
+from sqlalchemy import select
+
+from benchmarks.bench_load import seed
+from all_models import get_async_engine, Employee
+from auth import TokenOwner
+from bulk_import import EXPORT_BATCH_SIZE, format_employees
+from work_with_db_async import async_session, export_employees_by_owner
+
+
+OWNER = TokenOwner(id=1, company_id=1, iat=0, exp=0, jti="bench")
+
+
+async def listed(batch_size: int) -> AsyncIterator[List[Tuple[int, str]]]:
+    "Как до потоковой выгрузки: весь список объектов в памяти"
+
+    async with async_session(bind=get_async_engine()) as session:
+        employees = (await session.scalars(
+            select(Employee).where(Employee.company_id == 1).order_by(Employee.id))).all()
+
+    for start in range(0, len(employees), batch_size):
+        yield [(employee.id, employee.name) for employee in employees[start:start + batch_size]]
+
+
+async def streamed(batch_size: int) -> AsyncIterator[List[Tuple[int, str]]]:
+    async for batch in await export_employees_by_owner(OWNER, batch_size=batch_size):
+        yield batch
+
+
+async def measure(source: Callable[[int], AsyncIterator], export_format: str,
+                  batch_size: int) -> Tuple[float, float, int]:
+    "Время в секундах, пик памяти в МБ и размер тела в байтах"
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = 0
+
+    async for chunk in format_employees(export_format, source(batch_size)): # type: ignore
+        size += len(chunk)
+
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+
+    return elapsed, peak, size
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--employees", type=int, default=200_000)
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--batch", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    seed(owners=1, companies=1, employees=args.employees)
+
+    sizes = set()
+    for name, source in (("list", listed), ("stream", streamed)):
+        elapsed, peak, size = await measure(source, args.format, args.batch)
+        sizes.add(size)
+        print(f"{name:<7} {elapsed:7.2f} s  peak={peak:8.1f} MB  body={size / 2 ** 20:.1f} MB")
+
+    # Оба способа отдают одно и то же
+    assert len(sizes) == 1
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
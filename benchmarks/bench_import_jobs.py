@@ -0,0 +1,101 @@
+"""
+Бенчмарк большого импорта под нагрузкой: один владелец добавляет много
+сотрудников, а другие владельцы в это время добавляют по одному
+(POST /create/employee).
+
+    inline - POST /create/employees: весь импорт в одной транзакции
+             запроса, ответ после записи последней строки
+    job    - POST /import/employees/jobs: ответ 202 сразу, фоновая задача
+             пишет частями по GUDELO_IMPORT_JOB_CHUNK_ROWS, готовность
+             проверяется опросом GET /import/employees/jobs/{id}
+
+Для импорта печатает время ответа и время до записи всех строк, для
+одиночных вставок - p95/p99 и ошибки. Одна транзакция держит блокировку
+записи SQLite весь импорт, и одиночные вставки ждут ее до busy_timeout.
+Задача отпускает блокировку после каждой части на
+GUDELO_IMPORT_JOB_PAUSE_MS: импорт идет дольше, но вставки не падают.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_import_jobs --rows 200000 --requests 2000
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Dict, Tuple
+
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks.bench_load import auth_headers, run_scenario, seed
+from main import app
+
+
+async def import_inline(client: AsyncClient, headers: Dict[str, str],
+                        body: dict) -> Tuple[float, float]:
+    "Время ответа и время до записи всех строк в секундах"
+
+    start = time.perf_counter()
+    response = await client.post("/create/employees", json=body, headers=headers)
+    assert response.status_code == 201, response.text
+    elapsed = time.perf_counter() - start
+
+    return elapsed, elapsed
+
+
+async def import_job(client: AsyncClient, headers: Dict[str, str],
+                     body: dict) -> Tuple[float, float]:
+    "Время ответа и время до завершения задачи в секундах"
+
+    start = time.perf_counter()
+    response = await client.post("/import/employees/jobs", json=body, headers=headers)
+    assert response.status_code == 202, response.text
+    accepted = time.perf_counter() - start
+
+    while True:
+        job = (await client.get(response.headers["location"], headers=headers)).json()
+        if job["status"] != "queued" and job["status"] != "running":
+            break
+        await asyncio.sleep(0.05)
+
+    assert job["status"] == "done", job
+    return accepted, time.perf_counter() - start
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000,
+                        help="сотрудников в большом импорте")
+    parser.add_argument("--owners", type=int, default=50,
+                        help="владельцев с одиночными вставками")
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="одиночных вставок во время импорта")
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    body = {"array": [{"name": f"import_{i}"} for i in range(args.rows)]}
+
+    def make_request(i: int):
+        return 1 + i % args.owners, ("POST", "/create/employee", {"name": f"single_{i}"})
+
+    for name, run_import in (("inline", import_inline), ("job", import_job)):
+        seed(owners=args.owners + 1, companies=args.owners + 1, employees=0)
+        headers = auth_headers(args.owners + 1, args.owners + 1, mode="token")
+
+        async with app.router.lifespan_context(app):
+            # Ошибки бд (database is locked) считаются ответами 500
+            async with AsyncClient(transport=ASGITransport(app=app, raise_app_exceptions=False),
+                                   base_url="http://bench", timeout=None) as client:
+                (accepted, done), single = await asyncio.gather(
+                    run_import(client, headers[0], body),
+                    run_scenario(client, headers, make_request,
+                                 args.requests, args.concurrency))
+
+        print(f"{name:<7} import: response={accepted * 1000:9.1f} ms  "
+              f"done={done:6.2f} s  rows/s={args.rows / done:8.0f}   "
+              f"single: p95={single['p95_ms']:8.1f} ms  p99={single['p99_ms']:8.1f} ms  "
+              f"errors={single['errors']:.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
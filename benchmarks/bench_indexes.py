@@ -0,0 +1,132 @@
+"""
+Бенчмарк индексов: заполняет бд большим объемом данных и меряет задержку
+каждого роута без индексов (как в старых файлах бд) и после migrate_db().
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_indexes --owners 5000 --employees 100
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, text
+
+import work_with_db
+from benchmarks.bench_async_db import PASSWORD
+from all_models import get_engine, Base, Owner, Company, Employee
+from cache import owner_cache
+from hash_fun import hash_password
+from main import app
+
+
+def seed_large(owners: int, employees: int) -> None:
+    """
+    Быстрое заполнение бд через Core insert
+
+    owners: int
+        Количество владельцев (у каждого одна компания)
+
+    employees: int
+        Количество сотрудников в каждой компании
+    """
+
+    work_with_db.clear_db()
+    work_with_db.create_db()
+
+    # Один хеш на всех владельцев, чтобы не тратить время на scrypt
+    password = hash_password(PASSWORD)
+
+    with get_engine().begin() as connection:
+        connection.execute(insert(Owner), [
+            {"id": i + 1, "name": f"owner_{i:06}", "password": password}
+            for i in range(owners)])
+        connection.execute(insert(Company), [
+            {"id": i + 1, "name": f"company_{i:06}", "owner_id": i + 1}
+            for i in range(owners)])
+
+        for i in range(owners):
+            connection.execute(insert(Employee), [
+                {"name": f"employee_{j}", "company_id": i + 1}
+                for j in range(employees)])
+
+
+def drop_indexes() -> None:
+    "Удаляет индексы моделей, как будто бд создана до их появления"
+
+    with get_engine().begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(text(f'DROP INDEX IF EXISTS "{index.name}"'))
+
+
+def measure(call: Callable[[int], None], count: int) -> Dict[str, float]:
+    latencies: List[float] = []
+
+    for i in range(count):
+        start = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    return {"p50_ms": statistics.median(latencies) * 1000,
+            "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000}
+
+
+def run_phase(client: TestClient, count: int) -> Dict[str, Dict[str, float]]:
+    def auth(i: int) -> Dict[str, str]:
+        return {"authorization": f"owner_{i:06}:{PASSWORD}"}
+
+    def check(response) -> None:
+        assert response.status_code < 300, response.text
+
+    # Кэш авторизации прогрет заранее, меряется только сама операция
+    for i in range(2 * count):
+        check(client.get("/company/by/owner", headers=auth(i)))
+
+    return {
+        "GET /company/by/owner": measure(
+            lambda i: check(client.get("/company/by/owner", headers=auth(i))), count),
+        "POST /create/employee": measure(
+            lambda i: check(client.post("/create/employee", headers=auth(i),
+                                        json={"name": "bench"})), count),
+        "DELETE /create/employee": measure(
+            lambda i: check(client.request("DELETE", "/create/employee", headers=auth(i),
+                                           json={"name": "bench"})), count),
+        "DELETE /company": measure(
+            lambda i: check(client.request("DELETE", "/company", headers=auth(count + i),
+                                           json={"name": f"company_{count + i:06}"})), count),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--owners", type=int, default=5000)
+    parser.add_argument("--employees", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    client = TestClient(app)
+
+    for phase in ("without indexes", "with indexes"):
+        seed_large(owners=args.owners, employees=args.employees)
+        owner_cache.clear()
+        drop_indexes()
+
+        # Индексы возвращаются тем же путем, что и в старые файлы бд
+        if phase == "with indexes":
+            work_with_db.migrate_db()
+
+        print(f"--- {phase} ({args.owners} companies, "
+              f"{args.owners * args.employees} employees)")
+
+        for route, result in run_phase(client, count=args.requests).items():
+            print(f"{route:<25} " + "  ".join(f"{key}={value:.2f}"
+                                             for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Бенчмарк склейки одиночных вставок: POST /create/employee с отдельной
+транзакцией на каждый запрос (как было) против очереди вставок
+(employee_insert_queues), которая пишет строки разных запросов пачками
+(как стало).
+
+Оба режима идут на одинаково заполненной бд, переключается только
+склейка (enabled у очереди и employee_insert_batching в настройках).
+В конце проверяется, что в бд попали все сотрудники. Каждый режим
+гоняется --repeat раз, в конце печатаются медианы rps.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_insert_queue --requests 10000 --concurrency 100
+"""
+
+import argparse
+import asyncio
+import statistics
+from typing import Dict, List
+
+from sqlalchemy import func, select
+
+from benchmarks.bench_async_db import drive, seed
+from all_models import get_async_engine, dispose_engines, Employee
+from main import app
+from settings import settings
+from work_with_db_async import employee_insert_queues
+
+
+# Бенчмарк без шардирования: одна очередь на основную бд
+employee_insert_queue = employee_insert_queues[0]
+
+
+async def count_employees() -> int:
+    "Количество сотрудников в бд"
+
+    async with get_async_engine().connect() as connection:
+        return (await connection.execute(select(func.count()).select_from(Employee))).scalar_one()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--owners", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--batch-rows", type=int, default=employee_insert_queue.max_rows)
+    parser.add_argument("--batch-delay-ms", type=float,
+                        default=employee_insert_queue.max_delay * 1000)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="сколько раз прогнать каждый режим")
+    args = parser.parse_args()
+
+    employee_insert_queue.max_rows = args.batch_rows
+    employee_insert_queue.max_delay = args.batch_delay_ms / 1000
+
+    modes = (("per-request (before)", False), ("batched (after)", True))
+    rps: Dict[str, List[float]] = {name: [] for name, _ in modes}
+
+    # Режимы чередуются: разброс между прогонами на одной машине больше
+    # разницы между режимами, сравниваются медианы
+    for _ in range(args.repeat):
+        for name, enabled in modes:
+            headers = seed(owners=args.owners, employees=0)
+            # Соединения пула видели схему до пересоздания бд, как в bench_load
+            await dispose_engines()
+            employee_insert_queue.enabled = enabled
+            # Как при GUDELO_EMPLOYEE_INSERT_BATCHING: склеиваемые вставки
+            # идут в бюджет admission control insert, а не write
+            settings.employee_insert_batching = enabled
+            if enabled:
+                # Как в lifespan: соединение у очереди есть до первых запросов
+                await employee_insert_queue.start()
+
+            result = await drive(app=app, route="write", headers=headers,
+                                 total=args.requests, concurrency=args.concurrency)
+            await employee_insert_queue.stop()
+
+            assert await count_employees() == args.requests
+            rps[name].append(result["rps"])
+            print(f"{name:<21} " + "  ".join(f"{key}={value:.2f}"
+                                             for key, value in result.items()))
+
+    print(f"synchronous={settings.sqlite_synchronous}  "
+          f"delay_ms={args.batch_delay_ms:g}  " +
+          "  ".join(f"{name}: median rps={statistics.median(values):.1f}"
+                    for name, values in rps.items()))
+
+if __name__ == "__main__":
+    asyncio.run(main())
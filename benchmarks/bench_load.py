@@ -0,0 +1,275 @@
+"""
+Нагрузочный бенчмарк API: заполняет бд владельцами, компаниями и
+сотрудниками и гоняет каждый роут main.py параллельными запросами через
+ASGI транспорт httpx в одном процессе.
+
+Для каждого сценария печатает p50/p95/p99, среднее и запросов в секунду.
+Каждый сценарий идет на заново заполненной бд, поэтому пишущие и
+удаляющие сценарии не влияют друг на друга. По умолчанию запросы
+авторизуются токенами (без scrypt на первом запросе владельца),
+--auth password - заголовком 'имя:пароль'.
+
+Результат можно сохранить в JSON и сравнить со старым прогоном:
+    python -m benchmarks.bench_load --json after.json --baseline before.json
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_load --owners 1000 --companies 500 --employees 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Tuple
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import insert
+
+from benchmarks.bench_async_db import PASSWORD, START_DIR
+import work_with_db
+from all_models import get_engine, dispose_engines, Owner, Company, Employee
+from auth import revocation_store, token_signer
+from cache import owner_cache
+from hash_fun import hash_password
+from main import app
+
+
+# Запрос сценария: метод, путь и JSON тело для i-го запроса
+RequestSpec = Tuple[str, str, Any]
+
+
+def seed(owners: int, companies: int, employees: int) -> None:
+    """
+    Заполняет бд через Core insert. Компании есть у первых companies
+    владельцев, id компании совпадает с id владельца
+
+    owners: int
+        Количество владельцев
+
+    companies: int
+        Сколько из них с компанией
+
+    employees: int
+        Количество сотрудников в каждой компании
+    """
+
+    work_with_db.clear_db()
+    work_with_db.create_db()
+
+    # Один хеш на всех владельцев, чтобы не тратить время на scrypt
+    password = hash_password(PASSWORD)
+
+    with get_engine().begin() as connection:
+        connection.execute(insert(Owner), [
+            {"id": i + 1, "name": f"owner_{i:06}", "password": password}
+            for i in range(owners)])
+
+        if companies:
+            connection.execute(insert(Company), [
+                {"id": i + 1, "name": f"company_{i:06}", "owner_id": i + 1}
+                for i in range(companies)])
+
+        for i in range(companies if employees else 0):
+            connection.execute(insert(Employee), [
+                {"name": f"employee_{j}", "company_id": i + 1}
+                for j in range(employees)])
+
+
+def percentile(values: List[float], share: float) -> float:
+    "Перцентиль по ближайшему рангу, values отсортирован"
+
+    return values[max(0, min(len(values) - 1, round(share * len(values)) - 1))]
+
+
+def build_scenarios(owners: int, companies: int, employees: int,
+                    batch: int) -> Dict[str, Tuple[int, Callable[[int], Tuple[int, RequestSpec]]]]:
+    """
+    Сценарии по роутам. Для каждого - сколько запросов он может сделать
+    на заполненной бд (например, удалить компанию можно companies раз)
+    и функция, которая по номеру запроса возвращает номер владельца
+    и сам запрос
+    """
+
+    free = owners - companies
+
+    def with_company(i: int) -> int:
+        return i % companies
+
+    return {
+        "POST /create/owner": (
+            sys.maxsize,
+            lambda i: (-1, ("POST", "/create/owner",
+                            {"name": f"new_owner_{i:06}", "password": PASSWORD}))),
+        "POST /company": (
+            free,
+            lambda i: (companies + i, ("POST", "/company",
+                                       {"name": f"new_company_{i:06}"}))),
+        "GET /company/by/owner": (
+            sys.maxsize if companies else 0,
+            lambda i: (with_company(i), ("GET", "/company/by/owner", None))),
+        "GET /company/employees": (
+            sys.maxsize if companies else 0,
+            lambda i: (with_company(i), ("GET", "/company/employees?limit=100", None))),
+        "GET /company/summary": (
+            sys.maxsize if companies else 0,
+            lambda i: (with_company(i), ("GET", "/company/summary", None))),
+        "POST /create/employee": (
+            sys.maxsize if companies else 0,
+            lambda i: (with_company(i), ("POST", "/create/employee",
+                                         {"name": f"bench_{i}"}))),
+        "POST /create/employees": (
+            sys.maxsize if companies else 0,
+            lambda i: (with_company(i), ("POST", "/create/employees",
+                                         {"array": [{"name": f"bench_{i}_{j}"}
+                                                    for j in range(batch)]}))),
+        "DELETE /create/employee": (
+            companies * employees,
+            lambda i: (with_company(i), ("DELETE", "/create/employee",
+                                         {"name": f"employee_{i // companies}"}))),
+        "DELETE /company/employees": (
+            companies * (employees // batch),
+            lambda i: (with_company(i), ("DELETE", "/company/employees",
+                                         {"names": [f"employee_{(i // companies) * batch + j}"
+                                                    for j in range(batch)]}))),
+        "DELETE /company": (
+            companies,
+            lambda i: (i, ("DELETE", "/company", {"name": f"company_{i:06}"}))),
+    }
+
+
+def auth_headers(owners: int, companies: int, mode: str) -> List[Dict[str, str]]:
+    "Заголовки Authorization всех владельцев"
+
+    if mode == "password":
+        return [{"authorization": f"owner_{i:06}:{PASSWORD}"} for i in range(owners)]
+
+    return [{"authorization": "Bearer " + token_signer.issue(
+                owner_id=i + 1, company_id=i + 1 if i < companies else None)}
+            for i in range(owners)]
+
+
+async def run_scenario(client: AsyncClient, headers: List[Dict[str, str]],
+                       make_request: Callable[[int], Tuple[int, RequestSpec]],
+                       total: int, concurrency: int) -> Dict[str, float]:
+    "Гоняет total запросов сценария с заданной параллельностью"
+
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        nonlocal errors
+
+        for i in counter:
+            owner, (method, url, body) = make_request(i)
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body,
+                                            headers=headers[owner] if owner >= 0 else None)
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 300
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": total / elapsed,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline_path: str) -> None:
+    "Печатает изменение rps и p95 относительно сохраненного прогона"
+
+    with open(os.path.join(START_DIR, baseline_path)) as file:
+        baseline = json.load(file)["results"]
+
+    print(f"--- против {baseline_path}")
+
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+
+        print(f"{name:<27} rps {(result['rps'] / old['rps'] - 1) * 100:+7.1f}%  "
+              f"p95 {(result['p95_ms'] / old['p95_ms'] - 1) * 100:+7.1f}%")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--owners", type=int, default=400)
+    parser.add_argument("--companies", type=int, default=200,
+                        help="сколько владельцев с компанией (не больше --owners)")
+    parser.add_argument("--employees", type=int, default=20,
+                        help="сотрудников в каждой компании")
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="запросов на сценарий (меньше, если данных не хватит)")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=10,
+                        help="сотрудников в одном запросе массовых роутов")
+    parser.add_argument("--auth", choices=["token", "password"], default="token")
+    parser.add_argument("--scenario", action="append",
+                        help="запустить только этот сценарий, можно несколько раз")
+    parser.add_argument("--json", help="куда сохранить результат")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    if not 0 <= args.companies <= args.owners:
+        parser.error("--companies должно быть от 0 до --owners")
+
+    scenarios = build_scenarios(owners=args.owners, companies=args.companies,
+                                employees=args.employees, batch=args.batch)
+    headers = auth_headers(owners=args.owners, companies=args.companies, mode=args.auth)
+    results: Dict[str, Dict[str, float]] = {}
+
+    async with AsyncClient(transport=ASGITransport(app=app), # type: ignore
+                           base_url="http://bench", timeout=None) as client:
+        for name, (capacity, make_request) in scenarios.items():
+            if args.scenario and name not in args.scenario:
+                continue
+
+            total = min(args.requests, capacity)
+            if total <= 0:
+                print(f"{name:<27} пропущен: не хватает данных")
+                continue
+
+            seed(owners=args.owners, companies=args.companies, employees=args.employees)
+            owner_cache.clear()
+            revocation_store.clear()
+
+            # Соединения пула помнят схему до пересоздания таблиц, и SQLite
+            # в таком соединении не находит Employees из-за триггеров FTS5
+            await dispose_engines()
+
+            results[name] = await run_scenario(client, headers=headers,
+                                               make_request=make_request,
+                                               total=total, concurrency=args.concurrency)
+            print(f"{name:<27} " + "  ".join(f"{key}={value:.2f}" if isinstance(value, float)
+                                             else f"{key}={value}"
+                                             for key, value in results[name].items()))
+
+    if args.json:
+        with open(os.path.join(START_DIR, args.json), "w") as file:
+            json.dump({"meta": {"date": datetime.now(timezone.utc).isoformat(),
+                                "python": platform.python_version(),
+                                "args": vars(args)},
+                       "results": results}, file, indent=4, ensure_ascii=False)
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+Подсчет SQL запросов на каждый пишущий роут.
+
+Кэш авторизации перед каждым замером прогревается, поэтому в счет
+попадает только сама операция. Скрипт завершается с кодом 1, если
+какой-то роут выходит за бюджет в 2 запроса.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_query_count
+"""
+
+import sys
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from benchmarks.bench_async_db import PASSWORD, seed
+from all_models import get_async_engine
+from main import app
+
+
+BUDGET = 2
+
+
+@contextmanager
+def count_statements() -> Iterator[List[str]]:
+    "Собирает все выполненные за блок SQL запросы"
+
+    statements: List[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(get_async_engine().sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(get_async_engine().sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+def main() -> int:
+    seed(owners=1, employees=0)
+    client = TestClient(app)
+    auth = {"authorization": f"owner_new_1:{PASSWORD}"}
+
+    checks = [
+        ("POST /create/owner", "POST", "/create/owner",
+         {"name": "owner_new_1", "password": PASSWORD}),
+        ("DELETE /company", "DELETE", "/company", {"name": "company_00000"}),
+        ("POST /company", "POST", "/company", {"name": "company_new_1"}),
+        ("POST /create/employee", "POST", "/create/employee", {"name": "employee_1"}),
+        ("POST /create/employees", "POST", "/create/employees",
+         {"array": [{"name": f"employee_{i}"} for i in range(100)]}),
+        ("DELETE /create/employee", "DELETE", "/create/employee", {"name": "employee_1"}),
+    ]
+
+    failed = False
+
+    for label, method, url, body in checks:
+        headers = {"authorization": f"owner_00000:{PASSWORD}"} \
+                  if label == "DELETE /company" else auth
+
+        # Прогрев кэша авторизации
+        if label != "POST /create/owner":
+            client.get("/company/by/owner", headers=headers)
+
+        with count_statements() as statements:
+            response = client.request(method, url, json=body, headers=headers)
+
+        assert response.status_code < 300, (label, response.text)
+        failed |= len(statements) > BUDGET
+        print(f"{label:<25} statements={len(statements)}")
+
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
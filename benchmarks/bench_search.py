@@ -0,0 +1,132 @@
+"""
+Бенчмарк поиска сотрудников по подстроке имени внутри компании:
+
+    like - Employee.name LIKE '%...%' среди сотрудников компании (индекс по
+           company_id, каждое имя компании проверяется)
+    fts  - search_employees_by_owner: индекс FTS5 trigram (employees_fts)
+
+Имена случайные из слогов, запросы - случайные подстроки заданной
+длины из имен той же компании. Для каждой длины печатает среднее и p95
+задержки запроса. Перед замером проверяется, что без limit оба способа
+находят одних и тех же сотрудников.
+
+Чем короче подстрока, тем больше совпадений: LIKE с limit быстро
+набирает страницу, а FTS ранжирует (bm25) все совпадения. Чем длиннее
+подстрока и больше компания, тем больше выигрывает FTS: LIKE читает
+имена всей компании.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_search --companies 10 --employees 100000
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import Awaitable, Callable, List, Set, Tuple
+
+from sqlalchemy import insert, select
+
+from benchmarks.bench_load import percentile, seed
+from all_models import get_async_engine, get_engine, Employee
+from auth import TokenOwner
+from work_with_db_async import async_session, search_employees_by_owner
+
+
+# Слоги - все пары согласная + гласная и несколько закрытых слогов
+SYLLABLES = [consonant + vowel for consonant in "bdfgklmnprstvz" for vowel in "aeiouy"] \
+            + ["ard", "ber", "est", "ich", "ilt", "ond", "ush", "ov", "en", "in"]
+
+
+def random_name(rnd: random.Random) -> str:
+    first = "".join(rnd.choices(SYLLABLES, k=rnd.randint(2, 3))).capitalize()
+    last = "".join(rnd.choices(SYLLABLES, k=rnd.randint(2, 4))).capitalize()
+
+    return f"{first} {last}"
+
+
+def fill(companies: int, employees: int, rnd: random.Random) -> List[List[str]]:
+    "Заполняет бд и возвращает имена сотрудников каждой компании"
+
+    seed(owners=companies, companies=companies, employees=0)
+    names = [[random_name(rnd) for _ in range(employees)] for _ in range(companies)]
+
+    with get_engine().begin() as connection:
+        for i, company_names in enumerate(names):
+            connection.execute(insert(Employee), [{"name": name, "company_id": i + 1}
+                                                  for name in company_names])
+
+    return names
+
+
+async def search_like(company_id: int, query: str, limit: int) -> Set[int]:
+    stmt_select = select(Employee.id) \
+                    .where(Employee.company_id == company_id) \
+                    .where(Employee.name.contains(query, autoescape=True)) \
+                    .limit(limit)
+
+    async with async_session(bind=get_async_engine()) as session:
+        return set((await session.scalars(stmt_select)).all())
+
+
+async def search_fts(company_id: int, query: str, limit: int) -> Set[int]:
+    owner = TokenOwner(id=company_id, company_id=company_id, iat=0, exp=0, jti="bench")
+
+    async with async_session(bind=get_async_engine()) as session:
+        answer = await search_employees_by_owner(session, data_owner=owner,
+                                                 query=query, limit=limit)
+
+    return {item.id for item in answer.items}
+
+
+async def run(search: Callable[[int, str, int], Awaitable[Set[int]]],
+              queries: List[Tuple[int, str]], limit: int) -> Tuple[List[float], List[Set[int]]]:
+    latencies, results = [], []
+
+    for company_id, query in queries:
+        start = time.perf_counter()
+        results.append(await search(company_id, query, limit))
+        latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    return latencies, results
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--companies", type=int, default=10)
+    parser.add_argument("--employees", type=int, default=100_000,
+                        help="сотрудников в каждой компании")
+    parser.add_argument("--queries", type=int, default=100,
+                        help="запросов на каждую длину")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[3, 4, 6, 8])
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    names = fill(args.companies, args.employees, rnd)
+
+    for length in args.lengths:
+        queries = []
+        for _ in range(args.queries):
+            company = rnd.randrange(args.companies)
+            name = rnd.choice(names[company]).lower()
+            start = rnd.randrange(max(len(name) - length, 0) + 1)
+            queries.append((company + 1, name[start:start + length]))
+
+        _, like_all = await run(search_like, queries, limit=-1)
+        _, fts_all = await run(search_fts, queries, limit=1_000_000)
+        assert like_all == fts_all
+        matches = statistics.fmean(len(result) for result in like_all)
+
+        print(f"--- length {length}, {matches:.0f} matches per query")
+        for name, search in (("like", search_like), ("fts", search_fts)):
+            latencies, _ = await run(search, queries, args.limit)
+            print(f"{name:<5} mean={statistics.fmean(latencies) * 1000:8.2f} ms  "
+                  f"p95={percentile(latencies, 0.95) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""
+Микробенчмарк сериализации ответа /company/by/owner: только шаг от
+объекта Company из бд до байт тела ответа, без сети и бд.
+
+    before - CompanyAnswer(**company.__dict__), затем FastAPI повторно
+             проверяет ответ по response_model и кодирует его через
+             jsonable_encoder и json.dumps (JSONResponse)
+    after  - CompanyAnswer.model_validate(company) c from_attributes
+             и ModelResponse (model_dump_json в pydantic-core)
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_serialization --iterations 100000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Callable
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from all_models import Company, CompanyAnswer
+from responses import ModelResponse
+
+
+async def measure(step: Callable, iterations: int) -> float:
+    "Среднее время одного вызова в микросекундах"
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await step()
+
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    args = parser.parse_args()
+
+    company = Company(id=1, name="company_00000", owner_id=1)
+    field = create_response_field(name="Response_get_company", type_=CompanyAnswer,
+                                  mode="serialization")
+
+    async def before() -> bytes:
+        answer = CompanyAnswer(**company.__dict__)
+        content = await serialize_response(field=field, response_content=answer)
+        return JSONResponse(content).body
+
+    async def after() -> bytes:
+        return ModelResponse(CompanyAnswer.model_validate(company)).body
+
+    # Оба пути отдают один и тот же JSON
+    assert json.loads(await before()) == json.loads(await after())
+
+    results = {name: await measure(step, args.iterations)
+               for name, step in (("before", before), ("after", after))}
+
+    for name, usec in results.items():
+        print(f"{name:<7} {usec:.2f} us/response")
+
+    print(f"speedup x{results['before'] / results['after']:.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
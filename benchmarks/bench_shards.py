@@ -0,0 +1,124 @@
+"""
+Бенчмарк записи сотрудников при разном числе шардов: несколько процессов
+(как воркеры serve.py) параллельно шлют POST /create/employees от
+владельцев разных компаний в общие файлы бд.
+
+Без шардирования все процессы пишут в один файл и ждут одну блокировку
+записи SQLite. С N шардами компании разложены по N файлам, и запись в
+разные шарды идет параллельно.
+
+Каждое число шардов меряется на своей временной бд, настройки
+(GUDELO_DB_SHARDS) читаются процессами при импорте. Процессы стартуют
+одновременно, rows/s - все вставленные строки за время самого долгого.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_shards --shards 0 2 4 --processes 4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from benchmarks.bench_async_db import ROOT
+
+
+# bench_async_db при импорте уходит в свою временную директорию,
+# поэтому процессы возвращаются в общую директорию бенчмарка
+PRELUDE = """
+import asyncio, json, os, time
+from httpx import ASGITransport, AsyncClient
+from benchmarks.bench_load import auth_headers, run_scenario, seed
+os.chdir(%(workdir)r)
+from main import app
+"""
+
+SEED = PRELUDE + """
+seed(owners=%(companies)d, companies=%(companies)d, employees=0)
+"""
+
+WORKER = PRELUDE + """
+companies, processes, worker = %(companies)d, %(processes)d, %(worker)d
+total, concurrency, batch = %(requests)d, %(concurrency)d, %(batch)d
+
+# Каждый процесс пишет в свои компании
+headers = auth_headers(companies, companies, mode="token")[worker::processes]
+
+def make_request(i):
+    return i %% len(headers), ("POST", "/create/employees",
+                               {"array": [{"name": f"bench_{worker}_{i}_{j}"} for j in range(batch)]})
+
+async def main():
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+            await asyncio.sleep(max(%(start_at)f - time.time(), 0))
+            result = await run_scenario(client, headers, make_request, total, concurrency)
+
+    result["finished_at"] = time.time()
+    print(json.dumps(result))
+
+asyncio.run(main())
+"""
+
+
+def run_shards(shards: int, args: argparse.Namespace) -> Dict[str, float]:
+    "Замер для одного числа шардов на новой временной бд"
+
+    workdir = tempfile.mkdtemp(prefix="gudelo_bench_shards_")
+    env = dict(os.environ, PYTHONPATH=ROOT, GUDELO_DB_SHARDS=str(shards))
+    options = {"workdir": workdir, "companies": args.companies,
+               "processes": args.processes, "requests": args.requests,
+               "concurrency": args.concurrency, "batch": args.batch}
+
+    subprocess.run([sys.executable, "-c", SEED % options], env=env, cwd=ROOT, check=True)
+
+    # Запас на импорт приложения во всех процессах
+    start_at = time.time() + args.warmup
+    workers = [subprocess.Popen([sys.executable, "-c",
+                                 WORKER % dict(options, worker=worker, start_at=start_at)],
+                                env=env, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+               for worker in range(args.processes)]
+
+    results: List[Dict[str, float]] = []
+    for process in workers:
+        stdout, _ = process.communicate()
+        if process.returncode:
+            raise RuntimeError(f"Процесс бенчмарка завершился с кодом {process.returncode}")
+        results.append(json.loads(stdout.strip().splitlines()[-1]))
+
+    elapsed = max(result["finished_at"] for result in results) - start_at
+    rows = args.requests * args.processes * args.batch
+
+    return {"rows_per_s": rows / elapsed,
+            "p95_ms": max(result["p95_ms"] for result in results),
+            "errors": sum(result["errors"] for result in results)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 2, 4])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--companies", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=500,
+                        help="запросов от каждого процесса")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="параллельных запросов в каждом процессе")
+    parser.add_argument("--batch", type=int, default=200,
+                        help="сотрудников в одном запросе")
+    parser.add_argument("--warmup", type=float, default=5.0,
+                        help="секунд на старт процессов до начала замера")
+    args = parser.parse_args()
+
+    for shards in args.shards:
+        result = run_shards(shards, args)
+        print(f"shards={shards:<3} rows/s={result['rows_per_s']:10.0f}  "
+              f"p95_ms={result['p95_ms']:.2f}  errors={result['errors']:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Бенчмарк старта: время импорта схем и приложения и задержка первого
+запроса в новом процессе.
+
+Каждый замер идет в отдельном процессе интерпретатора (холодный импорт):
+    import_schemas_ms - import all_models (модели и схемы, без бд)
+    import_app_ms     - import main
+    startup_ms        - lifespan приложения (создание движка, первое соединение)
+    first_request_ms  - первый GET /company/by/owner
+    second_request_ms - второй такой же запрос
+
+Режим lifespan - как под uvicorn, режим lazy - без lifespan, движок
+создается на первом запросе.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_startup --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+from benchmarks.bench_async_db import ROOT, seed
+
+
+CHILD = """
+import time
+start = time.perf_counter()
+import all_models
+schemas = time.perf_counter()
+import main
+from fastapi.testclient import TestClient
+app_done = time.perf_counter()
+
+# Токен вместо пароля, чтобы в первый запрос не попал scrypt
+from auth import token_signer
+authorization = "Bearer " + token_signer.issue(owner_id=1, company_id=1)
+
+result = {"import_schemas_ms": (schemas - start) * 1000,
+          "import_app_ms": (app_done - schemas) * 1000}
+
+def requests(client):
+    for name in ("first_request_ms", "second_request_ms"):
+        begin = time.perf_counter()
+        response = client.get("/company/by/owner", headers={"authorization": authorization})
+        result[name] = (time.perf_counter() - begin) * 1000
+        assert response.status_code == 200, response.text
+
+client = TestClient(main.app)
+if %(lifespan)r:
+    begin = time.perf_counter()
+    with client:
+        result["startup_ms"] = (time.perf_counter() - begin) * 1000
+        requests(client)
+else:
+    result["startup_ms"] = 0.0
+    requests(client)
+
+print(__import__("json").dumps(result))
+"""
+
+
+def run_child(lifespan: bool) -> Dict[str, float]:
+    "Один замер в новом процессе, рабочая директория - временная бд"
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    output = subprocess.run([sys.executable, "-c", CHILD % {"lifespan": lifespan}],
+                            env=env, cwd=os.getcwd(), capture_output=True, text=True, check=True)
+
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    # Владелец и компания с id 1
+    seed(owners=1, employees=0)
+
+    for mode, lifespan in (("lifespan", True), ("lazy", False)):
+        runs: List[Dict[str, float]] = [run_child(lifespan) for _ in range(args.runs)]
+
+        print(f"--- {mode} (медиана из {args.runs})")
+        for key in runs[0]:
+            print(f"{key:<18} {statistics.median(run[key] for run in runs):8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import csv
+import io
+import json
+from fastapi import HTTPException
+from typing import AsyncIterator, Dict, List, Literal, Tuple
+
+
+__all__ = ["IMPORT_BATCH_SIZE", "IMPORT_MAX_BATCH_SIZE", "EXPORT_BATCH_SIZE",
+           "EXPORT_MEDIA_TYPES", "ExportFormat", "iter_lines",
+           "parse_employee_names", "batched", "format_employees"]
+
+
+# Сколько строк отправляется в бд одним executemany
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_BATCH_SIZE = 50_000
+
+# Сколько строк читается из курсора за раз при выгрузке, столько же
+# уходит клиенту одним куском тела ответа
+EXPORT_BATCH_SIZE = 1000
+
+ExportFormat = Literal["ndjson", "csv"]
+EXPORT_MEDIA_TYPES: Dict[str, str] = {"ndjson": "application/x-ndjson",
+                                      "csv": "text/csv; charset=utf-8"}
+
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl")
+CSV_TYPES = ("text/csv",)
+
+
+async def iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Режет поток байт из тела запроса на строки, не собирая тело целиком
+
+    stream: AsyncIterator[bytes]
+        Поток кусков тела запроса (Request.stream())
+    """
+
+    tail = b""
+    number = 0
+
+    async for chunk in stream:
+        tail += chunk
+        *lines, tail = tail.split(b"\n")
+
+        for line in lines:
+            number += 1
+            yield _decode_line(line, number)
+
+    if tail:
+        yield _decode_line(tail, number + 1)
+
+
+def _decode_line(line: bytes, number: int) -> str:
+    try:
+        return line.decode().rstrip("\r")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=422,
+                            detail=f"Строка {number}: текст не в кодировке UTF-8")
+
+
+async def _parse_ndjson(lines: AsyncIterator[str]) -> AsyncIterator[str]:
+    number = 0
+
+    async for line in lines:
+        number += 1
+        if not line.strip():
+            continue
+
+        try:
+            name = json.loads(line)["name"]
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=422,
+                                detail=f"Строка {number}: ожидается объект с полем 'name'")
+
+        if not isinstance(name, str) or not name:
+            raise HTTPException(status_code=422,
+                                detail=f"Строка {number}: поле 'name' должно быть непустой строкой")
+
+        yield name
+
+
+async def _parse_csv(lines: AsyncIterator[str]) -> AsyncIterator[str]:
+    number = 0
+    column = None
+
+    async for line in lines:
+        number += 1
+        if not line.strip():
+            continue
+
+        row = next(csv.reader([line]))
+
+        # Первая строка - заголовок, в нем должна быть колонка name
+        if column is None:
+            if "name" not in row:
+                raise HTTPException(status_code=422,
+                                    detail="В заголовке CSV нет колонки 'name'")
+            column = row.index("name")
+            continue
+
+        if column >= len(row) or not row[column]:
+            raise HTTPException(status_code=422,
+                                detail=f"Строка {number}: пустое поле 'name'")
+
+        yield row[column]
+
+
+def parse_employee_names(content_type: str,
+                         stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Возвращает поток имен сотрудников из тела запроса в формате NDJSON или CSV
+
+    NDJSON - по одному объекту {"name": "..."} на строку.
+    CSV - первая строка заголовок с колонкой name, поля с переводом строки
+    внутри кавычек не поддерживаются.
+
+    content_type: str
+        Значение заголовка Content-Type
+
+    stream: AsyncIterator[bytes]
+        Поток кусков тела запроса
+    """
+
+    media_type = content_type.split(";")[0].strip().lower()
+
+    if media_type in NDJSON_TYPES:
+        return _parse_ndjson(iter_lines(stream))
+
+    if media_type in CSV_TYPES:
+        return _parse_csv(iter_lines(stream))
+
+    raise HTTPException(status_code=415,
+                        detail="Поддерживаются только application/x-ndjson и text/csv")
+
+
+async def batched(names: AsyncIterator[str], size: int) -> AsyncIterator[List[str]]:
+    """
+    Группирует поток имен в пачки по size штук
+
+    names: AsyncIterator[str]
+        Поток имен
+
+    size: int
+        Размер пачки
+    """
+
+    batch: List[str] = []
+
+    async for name in names:
+        batch.append(name)
+
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+async def _format_ndjson(batches: AsyncIterator[List[Tuple[int, str]]]) -> AsyncIterator[bytes]:
+    async for batch in batches:
+        yield "".join(json.dumps({"id": employee_id, "name": name},
+                                 ensure_ascii=False, separators=(",", ":")) + "\n"
+                      for employee_id, name in batch).encode()
+
+
+async def _format_csv(batches: AsyncIterator[List[Tuple[int, str]]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["id", "name"])
+
+    async for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Только заголовок, если сотрудников нет
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def format_employees(export_format: ExportFormat,
+                     batches: AsyncIterator[List[Tuple[int, str]]]) -> AsyncIterator[bytes]:
+    """
+    Возвращает поток тела выгрузки сотрудников, один кусок на пачку строк.
+    Формат тот же, что принимает импорт: NDJSON - по объекту
+    {"id": .., "name": ..} на строку, CSV - заголовок id,name и строки
+
+    export_format: ExportFormat
+        ndjson или csv
+
+    batches: AsyncIterator[List[Tuple[int, str]]]
+        Пачки строк (id, name)
+    """
+
+    if export_format == "csv":
+        return _format_csv(batches)
+
+    return _format_ndjson(batches)
+
+
+if __name__ == "__main__":
+    pass
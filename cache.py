@@ -0,0 +1,235 @@
+import hashlib
+import secrets
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Hashable, Optional, Protocol, Set
+
+from all_models import Owner
+from settings import settings
+
+
+__all__ = ["CacheBackend", "TTLCache", "OwnerCache", "CompanyCache",
+           "owner_cache", "company_cache"]
+
+
+class CacheBackend(Protocol):
+    """
+    Хранилище для кэша чтения. По умолчанию TTLCache в памяти процесса,
+    при нескольких воркерах его можно заменить общим (например Redis):
+    ключи - строки, значения - байты, время жизни задает само хранилище
+    """
+
+    def get(self, key: str) -> Optional[bytes]:
+        "Значение по ключу или None"
+
+    def set(self, key: str, value: bytes) -> None:
+        "Кладет значение"
+
+    def delete(self, key: str) -> None:
+        "Удаляет значение, если оно есть"
+
+    def clear(self) -> None:
+        "Очищает хранилище"
+
+    def stats(self) -> Dict[str, int]:
+        "Счетчики для метрик, минимум hits и misses"
+
+
+class TTLCache:
+    """
+    LRU кэш ограниченного размера, записи в котором живут не дольше ttl секунд
+
+    maxsize: int
+        Максимальное количество записей, при переполнении вытесняется
+        самая давно использованная
+
+    ttl: float
+        Время жизни записи в секундах
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        "Возвращает значение по ключу или None, если его нет или оно устарело"
+
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        "Кладет значение в кэш, вытесняя самую старую запись при переполнении"
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        "Удаляет запись, если она есть"
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        "Очищает кэш и счетчики"
+
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        "Счетчики попаданий и промахов"
+
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self._data), "maxsize": self.maxsize}
+
+
+class OwnerCache:
+    """
+    Кэш проверенных данных авторизации владельцев
+
+    Ключ - это дайджест значения заголовка Authorization с секретом процесса,
+    поэтому пароли в открытом виде или их простые хеши в памяти не хранятся.
+    Кэш локален для процесса: при нескольких воркерах устаревание
+    ограничено ttl.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0) -> None:
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._keys_by_owner: Dict[int, Set[bytes]] = {}
+        self._secret = secrets.token_bytes(32)
+
+    def _digest(self, header: str) -> bytes:
+        return hashlib.blake2b(header.encode(), key=self._secret,
+                               digest_size=32).digest()
+
+    def get(self, header: str) -> Optional[Owner]:
+        """
+        Возвращает владельца для уже проверенного заголовка
+
+        header: str
+            Значение заголовка Authorization
+        """
+
+        return self._cache.get(self._digest(header))
+
+    def set(self, header: str, owner: Owner) -> None:
+        """
+        Запоминает владельца после успешной проверки пароля
+
+        header: str
+            Значение заголовка Authorization
+
+        owner: Owner
+            Владелец прошедший проверку
+        """
+
+        key = self._digest(header)
+        self._cache.set(key, owner)
+        self._keys_by_owner.setdefault(owner.id, set()).add(key)
+
+    def invalidate_owner(self, owner_id: int) -> None:
+        """
+        Сбрасывает все записи владельца, вызывается при изменении
+        владельца или его компании
+
+        owner_id: int
+            id владельца
+        """
+
+        for key in self._keys_by_owner.pop(owner_id, set()):
+            self._cache.delete(key)
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self._keys_by_owner.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats()
+
+
+class CompanyCache:
+    """
+    Кэш чтения компании по владельцу. Хранит готовое JSON тело ответа
+    /company/by/owner, поэтому подходит для любого хранилища байт.
+    Сбрасывается при создании и удалении компании владельца,
+    а в остальном устаревание ограничено временем жизни в хранилище
+
+    backend: CacheBackend
+        Хранилище
+    """
+
+    def __init__(self, backend: CacheBackend) -> None:
+        self.backend = backend
+
+    @staticmethod
+    def _key(owner_id: int) -> str:
+        return f"company_by_owner:{owner_id}"
+
+    def get(self, owner_id: int) -> Optional[bytes]:
+        """
+        JSON компании владельца или None, если его нет в кэше
+
+        owner_id: int
+            id владельца
+        """
+
+        return self.backend.get(self._key(owner_id))
+
+    def set(self, owner_id: int, body: bytes) -> None:
+        """
+        Запоминает JSON компании владельца
+
+        owner_id: int
+            id владельца
+
+        body: bytes
+            JSON компании
+        """
+
+        self.backend.set(self._key(owner_id), body)
+
+    def invalidate_owner(self, owner_id: int) -> None:
+        """
+        Сбрасывает компанию владельца
+
+        owner_id: int
+            id владельца
+        """
+
+        self.backend.delete(self._key(owner_id))
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return self.backend.stats()
+
+
+owner_cache = OwnerCache()
+
+company_cache = CompanyCache(backend=TTLCache(maxsize=settings.company_cache_size,
+                                              ttl=settings.company_cache_ttl))
+
+
+if __name__ == "__main__":
+    pass
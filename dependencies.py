@@ -0,0 +1,67 @@
+from fastapi import Depends, Header, HTTPException
+from admission import owner_rate_limiter, retry_after_seconds
+from sqlalchemy.ext.asyncio import AsyncSession
+from auth import BEARER_PREFIX, OwnerIdentity, token_signer
+from all_models import get_async_engine
+from work_with_db_async import async_session, check_owner_in_db
+from typing import Annotated, AsyncIterator
+
+
+__all__ = ["get_session", "SessionDep", "get_current_owner", "CurrentOwner"]
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    """
+    Зависимость FastAPI: одна сессия и одна транзакция на запрос.
+    Commit выполняется после роута, перед отправкой ответа, а любое
+    исключение в роуте (и HTTPException тоже) откатывает транзакцию.
+    Соединение берется из пула только при первом запросе к бд
+    """
+
+    async with async_session(bind=get_async_engine()) as session, session.begin():
+        yield session
+
+
+SessionDep = Annotated[AsyncSession, Depends(get_session)]
+
+
+async def get_current_owner(authorization: Annotated[str, Header()],
+                            session: SessionDep) -> OwnerIdentity:
+    """
+    Зависимость FastAPI: авторизует владельца по заголовку Authorization
+
+    'Bearer <токен>' проверяется по подписи без запроса в бд,
+    'имя:пароль' - через check_owner_in_db. Запросы владельца сверх
+    GUDELO_OWNER_RATE_LIMIT получают 429 с Retry-After
+
+    authorization: str
+        Заголовок в котором находится данные для авторизации владельца
+
+    session: AsyncSession
+        Сессия запроса, владелец из бд привязывается к ней
+    """
+
+    if authorization.startswith(BEARER_PREFIX):
+        owner = token_signer.verify(authorization[len(BEARER_PREFIX):])
+
+        if owner is None:
+            raise HTTPException(status_code=401,
+                                detail="Недействительный токен")
+    else:
+        owner = await check_owner_in_db(session, data_owner=authorization)
+
+    wait = owner_rate_limiter.hit(owner.id)
+
+    if wait:
+        raise HTTPException(status_code=429,
+                            detail="Слишком много запросов, повторите позже",
+                            headers={"Retry-After": retry_after_seconds(wait)})
+
+    return owner
+
+
+CurrentOwner = Annotated[OwnerIdentity, Depends(get_current_owner)]
+
+
+if __name__ == "__main__":
+    pass
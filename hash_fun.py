@@ -1,13 +1,36 @@
+import asyncio
+import base64
 import hashlib
+import hmac
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from settings import settings
 
 
-__all__ = ["convert_text_into_hash"]
+__all__ = ["convert_text_into_hash", "hash_password", "verify_password",
+           "needs_rehash", "hash_password_async", "verify_password_async"]
+
+
+# Параметры scrypt: ~16 Мб памяти и десятки мс на одно хеширование
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_DKLEN = 32
+SALT_SIZE = 16
+
+# Отдельный пул потоков под KDF, чтобы хеширование не блокировало event loop
+# и не занимало общий пул, через который работает бд
+_executor = ThreadPoolExecutor(max_workers=settings.password_hash_workers,
+                               thread_name_prefix="password-hash")
 
 
 def convert_text_into_hash(value: str):
     """
     Функция хеширует строку
 
+    Простой sha256 без соли, остался для проверки паролей владельцев,
+    созданных до перехода на scrypt
+
     value: str
         Строка которую будем хешировать
     """
@@ -17,5 +40,81 @@ def convert_text_into_hash(value: str):
     return answer
 
 
+def _b64encode(value: bytes) -> str:
+    return base64.b64encode(value).decode()
+
+
+def hash_password(password: str) -> str:
+    """
+    Хеширует пароль через scrypt со случайной солью
+
+    Результат хранит параметры, чтобы их можно было поднять без
+    поломки старых хешей: scrypt$n$r$p$<соль>$<хеш>
+
+    password: str
+        Пароль в открытом виде
+    """
+
+    salt = secrets.token_bytes(SALT_SIZE)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N,
+                            r=SCRYPT_R, p=SCRYPT_P, dklen=SCRYPT_DKLEN)
+
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}" \
+           f"${_b64encode(salt)}${_b64encode(digest)}"
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """
+    Проверяет пароль по хешу из бд, понимает и scrypt и старый sha256
+
+    password: str
+        Пароль в открытом виде
+
+    password_hash: str
+        Хеш из бд
+    """
+
+    if not password_hash.startswith("scrypt$"):
+        return hmac.compare_digest(convert_text_into_hash(value=password),
+                                   password_hash)
+
+    try:
+        _, n, r, p, salt, digest = password_hash.split("$")
+        expected = base64.b64decode(digest)
+        actual = hashlib.scrypt(password.encode(), salt=base64.b64decode(salt),
+                                n=int(n), r=int(r), p=int(p), dklen=len(expected))
+    except ValueError:
+        return False
+
+    return hmac.compare_digest(actual, expected)
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """
+    Нужно ли перехешировать пароль: старый sha256 или scrypt
+    с устаревшими параметрами
+
+    password_hash: str
+        Хеш из бд
+    """
+
+    return not password_hash.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+async def hash_password_async(password: str) -> str:
+    "hash_password в пуле потоков"
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, hash_password, password)
+
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+    "verify_password в пуле потоков"
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, verify_password,
+                                      password, password_hash)
+
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,247 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from fastapi import HTTPException
+from typing import Awaitable, Callable, List, Literal, Optional, Set
+
+
+__all__ = ["JobStatus", "ImportJob", "ImportJobQueue"]
+
+
+JobStatus = Literal["queued", "running", "done", "failed"]
+
+STOPPED_ERROR = "Импорт прерван остановкой сервера"
+
+
+class ImportJob:
+    "Задача фонового импорта сотрудников и ее прогресс"
+
+    __slots__ = ("id", "owner_id", "company_id", "total", "status", "rows_done",
+                 "rows_failed", "error", "started_at", "finished_at")
+
+    def __init__(self, owner_id: int, company_id: int, total: int) -> None:
+        self.id = uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.company_id = company_id
+        self.total = total
+        self.status: JobStatus = "queued"
+        self.rows_done = 0
+        self.rows_failed = 0
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    @property
+    def rows_per_s(self) -> float:
+        "Скорость записи строк с начала выполнения задачи"
+
+        if self.started_at is None:
+            return 0.0
+
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+
+        return self.rows_done / elapsed if elapsed > 0 else 0.0
+
+
+class ImportJobQueue:
+    """
+    Очередь фонового импорта: роут только кладет задачу в очередь и сразу
+    отвечает, а workers фоновых задач пишут строки в бд частями по
+    chunk_rows, каждая часть в своей транзакции. Между частями задача
+    ждет pause секунд: блокировка записи SQLite свободна, и обычные
+    запросы, которые ждут ее в busy_timeout, не ждут весь импорт
+
+    Очередь ограничена max_queued задачами: когда она полна, submit
+    отвечает 503, память под ожидающие задачи не растет. Задачи и их
+    прогресс хранятся в памяти процесса, завершенных помнится не больше
+    history. При нескольких воркерах у каждого своя очередь
+
+    insert: Callable[[int, List[str]], Awaitable[None]]
+        Вставка части имен в компанию с данным id в своей транзакции.
+        HTTPException из нее прерывает задачу (например, компания удалена),
+        другие исключения считают часть неудачной и импорт идет дальше
+
+    workers: int
+        Сколько задач выполняется одновременно
+
+    max_queued: int
+        Максимум задач, ждущих выполнения
+
+    chunk_rows: int
+        Строк в одной транзакции
+
+    history: int
+        Сколько завершенных задач хранить для запросов статуса
+
+    pause: float
+        Сколько секунд ждать после каждой части
+
+    retry_after: int
+        Значение заголовка Retry-After в секундах, когда очередь полна
+    """
+
+    def __init__(self, insert: Callable[[int, List[str]], Awaitable[None]],
+                 workers: int, max_queued: int, chunk_rows: int, history: int,
+                 pause: float = 0.0, retry_after: int = 5) -> None:
+        self.insert = insert
+        self.workers = workers
+        self.max_queued = max_queued
+        self.chunk_rows = chunk_rows
+        self.history = history
+        self.pause = pause
+        self.retry_after = retry_after
+        self._jobs: "OrderedDict[str, ImportJob]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._running: Set[asyncio.Task] = set()
+        self._closing = False
+
+    def start(self) -> None:
+        "Запускает workers в текущем event loop"
+
+        loop = asyncio.get_running_loop()
+
+        if self._workers and self._workers[0].get_loop() is loop \
+                and not any(worker.done() for worker in self._workers):
+            return
+
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._closing = False
+        self._workers = [loop.create_task(self._work(), name=f"import-job-{i}")
+                         for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        """
+        Останавливает workers. Выполняемые задачи дописывают текущую часть
+        и завершаются с ошибкой, задачи из очереди не выполняются
+        """
+
+        self._closing = True
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, *self._running, return_exceptions=True)
+        self._workers = []
+
+        while self._queue is not None and not self._queue.empty():
+            job, _ = self._queue.get_nowait()
+            job.rows_failed = job.total
+            job.error = STOPPED_ERROR
+            self._finish(job, failed=True)
+
+    def submit(self, owner_id: int, company_id: int, names: List[str]) -> ImportJob:
+        """
+        Ставит импорт в очередь и возвращает задачу
+
+        owner_id: int
+            id владельца, только он видит статус задачи
+
+        company_id: int
+            id компании, куда добавляются сотрудники
+
+        names: List[str]
+            Имена сотрудников
+        """
+
+        self.start()
+        job = ImportJob(owner_id=owner_id, company_id=company_id, total=len(names))
+
+        try:
+            self._queue.put_nowait((job, names)) # type: ignore
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=503,
+                                detail="Очередь импорта заполнена, повторите позже",
+                                headers={"Retry-After": str(self.retry_after)})
+
+        self._jobs[job.id] = job
+        self._forget_finished()
+
+        return job
+
+    def get(self, job_id: str, owner_id: int) -> Optional[ImportJob]:
+        """
+        Задача по id, если она есть и принадлежит владельцу
+
+        job_id: str
+            id задачи из ответа submit
+
+        owner_id: int
+            id владельца, который спрашивает статус
+        """
+
+        job = self._jobs.get(job_id)
+
+        if job is None or job.owner_id != owner_id:
+            return None
+
+        return job
+
+    def _forget_finished(self) -> None:
+        "Удаляет самые старые завершенные задачи сверх history"
+
+        finished = sum(job.finished for job in self._jobs.values())
+
+        for job_id in list(self._jobs):
+            if finished <= self.history:
+                break
+
+            if self._jobs[job_id].finished:
+                del self._jobs[job_id]
+                finished -= 1
+
+    def _finish(self, job: ImportJob, failed: bool) -> None:
+        job.status = "failed" if failed else "done"
+        job.finished_at = time.monotonic()
+
+    async def _work(self) -> None:
+        while True:
+            job, names = await self._queue.get() # type: ignore
+
+            # Отмена worker при остановке не прерывает задачу посреди
+            # части, stop дожидается ее через _running
+            task = asyncio.create_task(self._execute(job, names))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            await asyncio.shield(task)
+
+    async def _execute(self, job: ImportJob, names: List[str]) -> None:
+        job.status = "running"
+        job.started_at = time.monotonic()
+        aborted = False
+
+        for start in range(0, len(names), self.chunk_rows):
+            chunk = names[start:start + self.chunk_rows]
+
+            if self._closing:
+                job.error = STOPPED_ERROR
+            else:
+                try:
+                    await self.insert(job.company_id, chunk)
+                    job.rows_done += len(chunk)
+                    await asyncio.sleep(self.pause)
+                    continue
+                except HTTPException as exc:
+                    job.error = str(exc.detail)
+                except Exception as exc:
+                    # Ошибка одной части (например, бд занята дольше
+                    # busy_timeout), остальные части пробуются дальше
+                    job.rows_failed += len(chunk)
+                    job.error = str(exc)
+                    continue
+
+            job.rows_failed += len(names) - start
+            aborted = True
+            break
+
+        # Задача неудачна, если прервана или ни одна часть не записалась,
+        # ошибка последней неудачной части остается в error
+        self._finish(job, failed=aborted or (job.rows_failed > 0 and not job.rows_done))
+
+
+if __name__ == "__main__":
+    pass
@@ -1,27 +1,80 @@
-from fastapi import FastAPI, Header, HTTPException, Response
-from work_with_db import (
-    clear_db, create_db, insert_owner_in_db,
-    check_owner_in_db, insert_company_in_db, get_company_by_owner,
-    delete_company_from_db, have_count_company_owner,
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy.engine import Engine
+from work_with_db_async import (
+    insert_owner_in_db, login_owner, insert_company_in_db,
+    get_company_json_by_owner, get_company_summary, delete_company_from_db,
     insert_employee_in_db, insert_many_employee_in_db,
-    delete_employee_from_db
+    insert_stream_employee_in_db, delete_employee_from_db,
+    delete_many_employee_from_db, get_employees_by_owner,
+    export_employees_by_owner, search_employees_by_owner, employee_insert_queues,
+    employee_import_jobs, submit_employee_import, execute_batch, wait_shard_cleanups
     )
 from all_models import (
-    NewOwnerCreate, CompanyCreate, CompanyAnswer, CompanyDelete,
-    EmployeeBase, EmployeeMany
+    get_async_engine, dispose_engines, NewOwnerCreate, OwnerLogin, TokenAnswer,
+    CompanyCreate, CompanyAnswer, CompanyDelete, CompanySummary,
+    EmployeeBase, EmployeeMany, EmployeeDeleteMany, EmployeeSearchAnswer, ImportJobAnswer,
+    BatchRequest, BatchAnswer
     )
-from uvicorn import run
-from hash_fun import convert_text_into_hash
-from typing import Annotated, Dict
+from bulk_import import (
+    IMPORT_BATCH_SIZE, IMPORT_MAX_BATCH_SIZE, EXPORT_BATCH_SIZE, EXPORT_MEDIA_TYPES,
+    ExportFormat, parse_employee_names, batched, format_employees
+    )
+from admission import AdmissionMiddleware, admission_limits
+from auth import TokenOwner, revocation_store
+from dependencies import CurrentOwner, SessionDep
+from metrics import MetricsMiddleware, listen_engine, metrics_registry
+from responses import ModelResponse, json_with_etag
+from hash_fun import hash_password_async
+from settings import settings
+from contextlib import asynccontextmanager
+from typing import Annotated, AsyncIterator, Dict, Optional, Tuple
+import json
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Движок бд создается при старте приложения, а не при импорте. Первое
+    соединение (с PRAGMA) открывается здесь же, чтобы его не ждал первый
+    запрос. При остановке очереди вставок дописываются, фоновый импорт
+    дописывает текущую часть, сотрудники удаленных компаний удаляются
+    из шардов и соединения пулов закрываются
+    """
+
+    async with get_async_engine().connect():
+        pass
+
+    for queue in employee_insert_queues:
+        if queue.enabled:
+            await queue.start()
+
+    employee_import_jobs.start()
+
+    yield
+
+    await employee_import_jobs.stop()
+
+    for queue in employee_insert_queues:
+        await queue.stop()
 
+    await wait_shard_cleanups()
+    await dispose_engines()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+# Admission внутри метрик: отказы 503 тоже попадают в метрики
+app.add_middleware(AdmissionMiddleware, limits=admission_limits,
+                   retry_after=settings.admission_retry_after)
+app.add_middleware(MetricsMiddleware, registry=metrics_registry)
+# Хуки на класс Engine: движки создаются позже, в lifespan или при первом запросе
+listen_engine(Engine)
 
 
 
 
 @app.post(path="/create/owner")
-async def create_owner(owner: NewOwnerCreate) -> Response:
+async def create_owner(owner: NewOwnerCreate, session: SessionDep) -> Response:
     """
     Роут отвечает за создание нового владельца в базе данных
 
@@ -33,15 +86,55 @@ async def create_owner(owner: NewOwnerCreate) -> Response:
     """
 
     # Хешируем пароль
-    owner.password = convert_text_into_hash(value=owner.password)
-    insert_owner_in_db(new_user=owner)
+    owner.password = await hash_password_async(owner.password)
+    await insert_owner_in_db(session, new_user=owner)
     
     return Response(status_code=201)
 
 
+@app.post(path="/login", response_model=TokenAnswer)
+async def login(owner: OwnerLogin, session: SessionDep) -> ModelResponse:
+    """
+    Роут проверяет имя и пароль владельца и выдает подписанный токен
+    с id владельца и его компании. Дальше можно передавать заголовок
+    'Authorization: Bearer <токен>' вместо 'имя:пароль', такой запрос
+    не ходит в бд за владельцем. После создания или удаления компании
+    старые токены отзываются и нужно войти заново
+
+    owner: OwnerLogin
+        Класс описывает какое тело запроса ожидаеться
+
+    return: TokenAnswer
+        Класс описывающий модель ответа в JSON
+    """
+
+    token = await login_owner(session, name=owner.name, password=owner.password)
+
+    return ModelResponse(TokenAnswer(access_token=token))
+
+
+@app.post(path="/logout")
+async def logout(owner: CurrentOwner) -> Response:
+    """
+    Роут отзывает токен, с которым пришел запрос
+
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (Bearer токен)
+    """
+
+    if not isinstance(owner, TokenOwner):
+        raise HTTPException(status_code=400,
+                            detail="Выход возможен только по токену")
+
+    revocation_store.revoke_token(jti=owner.jti, expires_at=owner.exp)
+
+    return Response(status_code=204)
+
+
 @app.post(path="/company")
 async def add_company(new_company: CompanyCreate,
-                      authorization: Annotated[str, Header()]) -> Response:
+                      owner: CurrentOwner,
+                      session: SessionDep) -> Response:
     """
     Роут отвечает за создание новой компании в базе данных
     и принадлежит тому владельцу, который прислал заявку
@@ -49,23 +142,22 @@ async def add_company(new_company: CompanyCreate,
     new_company: CompanyCreate
         Класс описывает какое тело запроса ожидаеться
 
-    authorization: str 
-        Заголовок в котором находится данные для авторизации владельца
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
 
     return: CompanyAnswer
         Класс описывающий модель ответа в JSON    
     """
 
-    owner = check_owner_in_db(data_owner=authorization)
-    have_count_company_owner(data_owner=owner, data_company=new_company)
-    insert_company_in_db(data_company=new_company, data_owner=owner)
+    await insert_company_in_db(session, data_company=new_company, data_owner=owner)
 
     return Response(status_code=201)
     
 
 @app.delete(path="/company")
 async def delete_company(has_company: CompanyDelete,
-                         authorization: Annotated[str, Header()]) -> Response:
+                         owner: CurrentOwner,
+                         session: SessionDep) -> Response:
     """
     Роут отвечает за удаление компании из базы данных того владельца
     кто ее прислал
@@ -73,96 +165,379 @@ async def delete_company(has_company: CompanyDelete,
     has_company: CompanyDelete
         Класс описывает какое тело запроса ожидаеться
 
-    authorization: str 
-        Заголовок в котором находится данные для авторизации владельца
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
     """
 
-    owner = check_owner_in_db(data_owner=authorization)
-    delete_company_from_db(data_company=has_company, data_owner=owner)
+    await delete_company_from_db(session, data_company=has_company, data_owner=owner)
 
     return Response(status_code=201)
 
 
-@app.get(path="/company/by/owner")
-async def get_company_by_has_owner(authorization: Annotated[str, Header()]) -> CompanyAnswer:
+@app.get(path="/company/by/owner", response_model=CompanyAnswer,
+         responses={304: {"description": "Компания не изменилась (If-None-Match)"}})
+async def get_company_by_has_owner(owner: CurrentOwner,
+                                   session: SessionDep,
+                                   if_none_match: Annotated[Optional[str], Header()] = None
+                                   ) -> Response:
     """
-    Роут выполняет поиск компании по владельцу, который прислал заявку
+    Роут выполняет поиск компании по владельцу, который прислал заявку.
+    Ответ берется из кэша чтения и содержит ETag: с заголовком
+    If-None-Match и тем же ETag вернется 304 без тела
+
+     owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
 
-     authorization: str 
-        Заголовок в котором находится данные для авторизации владельца
+    if_none_match: Optional[str]
+        ETag версии компании, которая уже есть у клиента
 
     return: CompanyAnswer
         Класс описывающий модель ответа в JSON
     """
     
-    owner = check_owner_in_db(data_owner=authorization)
-    company = get_company_by_owner(data_owner=owner)
+    body = await get_company_json_by_owner(session, data_owner=owner)
 
-    if company is None:
+    if body is None:
         raise HTTPException(status_code=404,
                             detail="Компании по этому владельцу нету")
     
-    return CompanyAnswer(**company.__dict__)
+    return json_with_etag(body, if_none_match=if_none_match)
+
+
+@app.get(path="/company/summary", response_model=CompanySummary)
+async def get_company_summary_by_owner(owner: CurrentOwner,
+                                       session: SessionDep,
+                                       top: Annotated[int, Query(ge=0, le=100)] = 5
+                                       ) -> Response:
+    """
+    Роут отдает сводку по сотрудникам компании владельца: количество
+    сотрудников, количество разных имен и самые частые имена
+
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
+
+    top: int
+        Сколько самых частых имен вернуть
+
+    return: CompanySummary
+        Класс описывающий модель ответа в JSON
+    """
+
+    summary = await get_company_summary(session, data_owner=owner, top=top)
+
+    return ModelResponse(summary)
+
+
+async def employees_page_json(rows: AsyncIterator[Tuple[int, str]]) -> AsyncIterator[bytes]:
+    """
+    Потоково собирает JSON страницы сотрудников:
+    {"items": [{"id": .., "name": ..}, ..], "next_after_id": ..}
+
+    next_after_id - курсор для следующей страницы, null если страница пустая
+    """
+
+    last_id = None
+    separator = ""
+
+    yield b'{"items":['
+
+    async for employee_id, name in rows:
+        yield (separator + json.dumps({"id": employee_id, "name": name},
+                                      ensure_ascii=False,
+                                      separators=(",", ":"))).encode()
+        separator = ","
+        last_id = employee_id
+
+    yield f'],"next_after_id":{json.dumps(last_id)}}}'.encode()
+
+
+@app.get(path="/company/employees")
+async def get_employees(owner: CurrentOwner,
+                        after_id: Annotated[int, Query(ge=0)] = 0,
+                        limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+                        prefix: Annotated[Optional[str], Query(min_length=1,
+                                                               max_length=50)] = None
+                        ) -> StreamingResponse:
+    """
+    Роут отдает сотрудников компании владельца постранично по курсору.
+    Для следующей страницы передается after_id из next_after_id ответа
+
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
+
+    after_id: int
+        id последнего сотрудника с предыдущей страницы
+
+    limit: int
+        Размер страницы
+
+    prefix: Optional[str]
+        Начало имени сотрудника
+    """
+
+    rows = await get_employees_by_owner(data_owner=owner, after_id=after_id,
+                                        limit=limit, prefix=prefix)
+
+    return StreamingResponse(employees_page_json(rows),
+                             media_type="application/json")
+
+
+@app.get(path="/company/employees/search", response_model=EmployeeSearchAnswer)
+async def search_employees(owner: CurrentOwner,
+                           session: SessionDep,
+                           q: Annotated[str, Query(min_length=1, max_length=50)],
+                           limit: Annotated[int, Query(ge=1, le=100)] = 20) -> Response:
+    """
+    Роут ищет сотрудников компании владельца по подстроке имени без учета
+    регистра, лучшие совпадения первыми
+
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
+
+    q: str
+        Подстрока имени
+
+    limit: int
+        Сколько сотрудников вернуть
+
+    return: EmployeeSearchAnswer
+        Класс описывающий модель ответа в JSON
+    """
+
+    answer = await search_employees_by_owner(session, data_owner=owner, query=q, limit=limit)
+
+    return ModelResponse(answer)
 
 
 @app.post(path="/create/employee")
 async def add_employee(new_employee: EmployeeBase,
-                        authorization: Annotated[str, Header()]) -> Response:
+                        owner: CurrentOwner,
+                        session: SessionDep) -> Response:
     """
     Роут выполняет в ед. числе вставку сотрудника в базу данных
     
     new_employee: EmployeeBase
         Класс описывающий какое тело запроса ожидается
 
-    authorization: str 
-        Заголовок в котором находится данные для авторизации владельца
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
     """
 
-    owner = check_owner_in_db(data_owner=authorization)
-    insert_employee_in_db(data_owner=owner, data_employee=new_employee)
+    await insert_employee_in_db(session, data_owner=owner, data_employee=new_employee)
 
     return Response(status_code=201)
 
 
 @app.post(path="/create/employees")
 async def add_employees(employees: EmployeeMany,
-                        authorization: Annotated[str, Header()]) -> Response:
+                        owner: CurrentOwner,
+                        session: SessionDep) -> Response:
     """
     Роут отвечает за множественнуое добавление сотрудников в базу данных
     
     employees: EmployeeMany
         Класс описывающий какое тело запроса ожидается
 
-    authorization: str 
-        Заголовок в котором находится данные для авторизации владельца
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
     """
 
-    owner = check_owner_in_db(data_owner=authorization)
-    insert_many_employee_in_db(data_owner=owner, data_employees=employees)
+    await insert_many_employee_in_db(session, data_owner=owner, data_employees=employees)
 
     return Response(status_code=201)
 
 
+@app.post(path="/import/employees/jobs", status_code=202, response_model=ImportJobAnswer,
+          responses={503: {"description": "Очередь импорта заполнена (Retry-After)"}})
+async def add_employees_job(employees: EmployeeMany,
+                            owner: CurrentOwner) -> ModelResponse:
+    """
+    Роут принимает то же тело, что и /create/employees, но не пишет его
+    в бд во время запроса: импорт ставится в фоновую очередь и сразу
+    возвращается задача со статусом queued. Прогресс отдает
+    GET /import/employees/jobs/{job_id} (адрес в заголовке Location)
+
+    employees: EmployeeMany
+        Класс описывающий какое тело запроса ожидается
+
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
+
+    return: ImportJobAnswer
+        Класс описывающий модель ответа в JSON
+    """
+
+    job = submit_employee_import(data_owner=owner, data_employees=employees)
+
+    return ModelResponse(ImportJobAnswer.model_validate(job), status_code=202,
+                         headers={"Location": f"/import/employees/jobs/{job.id}"})
+
+
+@app.get(path="/import/employees/jobs/{job_id}", response_model=ImportJobAnswer)
+async def get_employees_job(job_id: str, owner: CurrentOwner) -> ModelResponse:
+    """
+    Роут отдает статус фонового импорта владельца: сколько строк записано
+    и не записано, скорость записи и ошибку, если она была
+
+    job_id: str
+        id задачи из ответа POST /import/employees/jobs
+
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
+
+    return: ImportJobAnswer
+        Класс описывающий модель ответа в JSON
+    """
+
+    job = employee_import_jobs.get(job_id, owner_id=owner.id)
+
+    if job is None:
+        raise HTTPException(status_code=404,
+                            detail="Задачи импорта с таким id нету")
+
+    return ModelResponse(ImportJobAnswer.model_validate(job))
+
+
+@app.post(path="/import/employees", status_code=201)
+async def import_employees(request: Request,
+                           owner: CurrentOwner,
+                           session: SessionDep,
+                           content_type: Annotated[str, Header()],
+                           batch_size: Annotated[int, Query(ge=1, le=IMPORT_MAX_BATCH_SIZE)] = IMPORT_BATCH_SIZE
+                           ) -> Dict[str, int]:
+    """
+    Роут выполняет потоковый импорт сотрудников из тела в формате
+    NDJSON (application/x-ndjson) или CSV (text/csv). Тело читается
+    по кускам и пишется в бд пачками в одной транзакции
+
+    request: Request
+        Запрос, из которого читается поток тела
+
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
+
+    content_type: str
+        Формат тела запроса
+
+    batch_size: int
+        Сколько строк вставлять за один запрос к бд
+
+    return: Dict[str, int]
+        Количество добавленных сотрудников
+    """
+
+    names = parse_employee_names(content_type=content_type, stream=request.stream())
+    count = await insert_stream_employee_in_db(session, data_owner=owner,
+                                               batches=batched(names, size=batch_size))
+
+    return {"inserted": count}
+
+
+@app.get(path="/export/employees",
+         responses={200: {"content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()}}})
+async def export_employees(owner: CurrentOwner,
+                           format: ExportFormat = "ndjson") -> StreamingResponse:
+    """
+    Роут выгружает всех сотрудников компании владельца в NDJSON или CSV.
+    Ответ отдается потоком прямо из курсора бд, выгрузка любого размера
+    идет в постоянной памяти
+
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
+
+    format: ExportFormat
+        ndjson или csv
+    """
+
+    batches = await export_employees_by_owner(data_owner=owner, batch_size=EXPORT_BATCH_SIZE)
+
+    return StreamingResponse(format_employees(format, batches),
+                             media_type=EXPORT_MEDIA_TYPES[format],
+                             headers={"Content-Disposition":
+                                      f'attachment; filename="employees.{format}"'})
+
+
 @app.delete(path="/create/employee")
 async def delete_employee(employee: EmployeeBase,
-                          authorization: Annotated[str, Header()]) -> Response:
+                          owner: CurrentOwner,
+                          session: SessionDep) -> Response:
     """
     Роут отвечает за удаление сотрудника из база данных
 
     employee: EmployeeBase
         Класс описывающий как тело запроса ожидается
 
-    authorization: str
-        Заголовок в котором находится данные для авторизации владельца
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
     """
 
-    owner = check_owner_in_db(data_owner=authorization)
-    delete_employee_from_db(data_owner=owner, data_employee=employee)
+    await delete_employee_from_db(session, data_owner=owner, data_employee=employee)
 
     return Response(status_code=201)
 
 
+@app.delete(path="/company/employees")
+async def delete_employees(employees: EmployeeDeleteMany,
+                           owner: CurrentOwner,
+                           session: SessionDep) -> Dict[str, int]:
+    """
+    Роут удаляет сотрудников компании владельца по списку имен и/или id
+    одним запросом к бд
+
+    employees: EmployeeDeleteMany
+        Класс описывающий какое тело запроса ожидается
+
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
+
+    return: Dict[str, int]
+        Количество удаленных сотрудников
+    """
+
+    count = await delete_many_employee_from_db(session, data_owner=owner,
+                                               data_employees=employees)
+
+    return {"deleted": count}
+
+
+@app.post(path="/batch", response_model=BatchAnswer)
+async def batch(data_batch: BatchRequest,
+                owner: CurrentOwner,
+                session: SessionDep) -> ModelResponse:
+    """
+    Роут выполняет пакет операций (добавление и удаление сотрудников,
+    компания и сводка) по порядку в одной транзакции с одной авторизацией.
+    mode=atomic - при ошибке операции откатывается весь пакет и
+    возвращается ее код с номером операции, mode=independent - ошибка
+    откатывает только свою операцию и попадает в ее результат
+
+    data_batch: BatchRequest
+        Класс описывающий какое тело запроса ожидается
+
+    owner: OwnerIdentity
+        Владелец из заголовка Authorization (имя:пароль или Bearer токен)
+
+    return: BatchAnswer
+        Класс описывающий модель ответа в JSON
+    """
+
+    answer = await execute_batch(session, data_owner=owner, data_batch=data_batch)
+
+    return ModelResponse(answer)
+
+
+@app.get(path="/metrics", include_in_schema=False)
+async def metrics() -> PlainTextResponse:
+    """
+    Роут отдает метрики процесса в текстовом формате Prometheus:
+    ответы и время ответа по роутам, SQL запросы и время в бд,
+    счетчики кэшей авторизации и компаний
+    """
+
+    return PlainTextResponse(metrics_registry.render(),
+                             media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
-    clear_db()
-    create_db()
-    run(app)
\ No newline at end of file
+    from serve import main as serve
+    serve()
\ No newline at end of file
@@ -0,0 +1,281 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from admission import admission_limits, owner_rate_limiter
+from cache import company_cache, owner_cache
+from typing import Dict, List, Optional, Tuple, Type, Union
+
+
+__all__ = ["RequestStats", "MetricsRegistry", "MetricsMiddleware",
+           "listen_engine", "metrics_registry"]
+
+
+# Границы гистограммы времени ответа в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+class RequestStats:
+    "SQL запросы и время в бд одного HTTP запроса"
+
+    __slots__ = ("statements", "db_time")
+
+    def __init__(self) -> None:
+        self.statements = 0
+        self.db_time = 0.0
+
+
+# Статистика текущего запроса. SQLAlchemy выполняет хуки курсора в том же
+# контексте, что и роут, поэтому счетчики попадают в свой запрос
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats",
+                                                                default=None)
+
+
+class _RouteMetrics:
+    "Накопленные метрики одного роута"
+
+    __slots__ = ("requests", "statements", "db_time", "buckets", "duration")
+
+    def __init__(self) -> None:
+        self.requests: Dict[int, int] = {}
+        self.statements = 0
+        self.db_time = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.duration = 0.0
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """
+    Метрики роутов в памяти процесса: число ответов по статусам,
+    гистограмма времени ответа, число SQL запросов и время в бд.
+    При нескольких воркерах у каждого свой реестр
+    """
+
+    def __init__(self) -> None:
+        self._routes: Dict[Tuple[str, str], _RouteMetrics] = {}
+        self._lock = Lock()
+
+    def observe(self, method: str, route: str, status: int,
+                duration: float, stats: RequestStats) -> None:
+        """
+        Учитывает один завершенный запрос
+
+        method: str
+            HTTP метод
+
+        route: str
+            Шаблон пути роута, например /company/employees
+
+        status: int
+            Код ответа
+
+        duration: float
+            Время обработки в секундах
+
+        stats: RequestStats
+            SQL запросы запроса
+        """
+
+        with self._lock:
+            metrics = self._routes.get((method, route))
+
+            if metrics is None:
+                metrics = self._routes[(method, route)] = _RouteMetrics()
+
+            metrics.requests[status] = metrics.requests.get(status, 0) + 1
+            metrics.statements += stats.statements
+            metrics.db_time += stats.db_time
+            metrics.buckets[bisect_left(LATENCY_BUCKETS, duration)] += 1
+            metrics.duration += duration
+
+    def clear(self) -> None:
+        with self._lock:
+            self._routes.clear()
+
+    def render(self) -> str:
+        "Метрики в текстовом формате Prometheus"
+
+        with self._lock:
+            routes = sorted(self._routes.items())
+
+            lines: List[str] = [
+                "# HELP gudelo_http_requests_total Количество ответов",
+                "# TYPE gudelo_http_requests_total counter",
+                ]
+            for (method, route), metrics in routes:
+                for status, count in sorted(metrics.requests.items()):
+                    lines.append(f'gudelo_http_requests_total{{method="{method}",'
+                                 f'route="{_label(route)}",status="{status}"}} {count}')
+
+            lines += ["# HELP gudelo_http_request_duration_seconds Время ответа",
+                      "# TYPE gudelo_http_request_duration_seconds histogram"]
+            for (method, route), metrics in routes:
+                labels = f'method="{method}",route="{_label(route)}"'
+                cumulative = 0
+
+                for bound, count in zip(LATENCY_BUCKETS, metrics.buckets):
+                    cumulative += count
+                    lines.append(f'gudelo_http_request_duration_seconds_bucket'
+                                 f'{{{labels},le="{bound}"}} {cumulative}')
+
+                cumulative += metrics.buckets[-1]
+                lines += [f'gudelo_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {cumulative}',
+                          f'gudelo_http_request_duration_seconds_sum{{{labels}}} {metrics.duration}',
+                          f'gudelo_http_request_duration_seconds_count{{{labels}}} {cumulative}']
+
+            lines += ["# HELP gudelo_db_statements_total Количество SQL запросов",
+                      "# TYPE gudelo_db_statements_total counter"]
+            for (method, route), metrics in routes:
+                lines.append(f'gudelo_db_statements_total{{method="{method}",'
+                             f'route="{_label(route)}"}} {metrics.statements}')
+
+            lines += ["# HELP gudelo_db_duration_seconds_total Время выполнения SQL запросов",
+                      "# TYPE gudelo_db_duration_seconds_total counter"]
+            for (method, route), metrics in routes:
+                lines.append(f'gudelo_db_duration_seconds_total{{method="{method}",'
+                             f'route="{_label(route)}"}} {metrics.db_time}')
+
+        for name, title, cache in (("owner", "кэша авторизации", owner_cache),
+                                   ("company", "кэша компаний", company_cache)):
+            cache_stats = cache.stats()
+            lines += [f"# HELP gudelo_{name}_cache_hits_total Попадания {title}",
+                      f"# TYPE gudelo_{name}_cache_hits_total counter",
+                      f"gudelo_{name}_cache_hits_total {cache_stats['hits']}",
+                      f"# HELP gudelo_{name}_cache_misses_total Промахи {title}",
+                      f"# TYPE gudelo_{name}_cache_misses_total counter",
+                      f"gudelo_{name}_cache_misses_total {cache_stats['misses']}"]
+
+            # Размер знает не всякое хранилище
+            if "size" in cache_stats:
+                lines += [f"# HELP gudelo_{name}_cache_size Записей {title}",
+                          f"# TYPE gudelo_{name}_cache_size gauge",
+                          f"gudelo_{name}_cache_size {cache_stats['size']}"]
+
+        lines += ["# HELP gudelo_admission_active Запросов выполняется по классам роутов",
+                  "# TYPE gudelo_admission_active gauge"]
+        admission = sorted((route_class, limit.stats())
+                           for route_class, limit in admission_limits.items())
+        for route_class, limit_stats in admission:
+            lines.append(f'gudelo_admission_active{{class="{route_class}"}} {limit_stats["active"]}')
+
+        lines += ["# HELP gudelo_admission_queued Запросов ждет в очереди по классам роутов",
+                  "# TYPE gudelo_admission_queued gauge"]
+        for route_class, limit_stats in admission:
+            lines.append(f'gudelo_admission_queued{{class="{route_class}"}} {limit_stats["queued"]}')
+
+        lines += ["# HELP gudelo_admission_rejected_total Отказов 503 по классам роутов и причинам",
+                  "# TYPE gudelo_admission_rejected_total counter"]
+        for route_class, limit_stats in admission:
+            for reason in ("queue_full", "timeout"):
+                lines.append(f'gudelo_admission_rejected_total{{class="{route_class}",'
+                             f'reason="{reason}"}} {limit_stats[reason]}')
+
+        lines += ["# HELP gudelo_rate_limited_total Отказов 429 по лимиту владельца",
+                  "# TYPE gudelo_rate_limited_total counter",
+                  f"gudelo_rate_limited_total {owner_rate_limiter.limited}"]
+
+        return "\n".join(lines) + "\n"
+
+
+# Время старта хранится в контексте выполнения, а не в conn.info: если
+# запрос упал, after_cursor_execute не вызывается и в соединении ничего
+# не остается
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is not None and _request_stats.get() is not None:
+        context.metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    stats = _request_stats.get()
+    start = getattr(context, "metrics_start", None)
+
+    if stats is not None and start is not None:
+        stats.statements += 1
+        stats.db_time += time.perf_counter() - start
+
+
+def listen_engine(sync_engine: Union[Engine, Type[Engine]]) -> None:
+    """
+    Вешает на движок хуки курсора, которые считают SQL запросы и время
+    в бд для текущего HTTP запроса. Запросы вне HTTP запроса не считаются
+
+    sync_engine: Engine | Type[Engine]
+        Движок (для асинхронного - его sync_engine) или класс Engine,
+        тогда хуки работают и для движков, созданных позже
+    """
+
+    if not event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: считает время ответа и SQL запросы каждого запроса,
+    отдает их в заголовке Server-Timing и складывает в реестр метрик
+
+    Для потоковых ответов Server-Timing отправляется до тела, поэтому
+    в нем нет запросов, выполненных при чтении тела, в реестр они попадают
+
+    app: ASGIApp
+        Приложение
+
+    registry: MetricsRegistry
+        Реестр, куда пишутся метрики
+    """
+
+    def __init__(self, app: ASGIApp, registry: MetricsRegistry) -> None:
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total_ms = (time.perf_counter() - start) * 1000
+                timing = f'db;dur={stats.db_time * 1000:.2f};desc="{stats.statements} queries", ' \
+                         f'total;dur={total_ms:.2f}'
+                message["headers"] = [*message.get("headers", []),
+                                      (b"server-timing", timing.encode())]
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stats.reset(token)
+
+            route = scope.get("route")
+            self.registry.observe(method=scope["method"],
+                                  route=getattr(route, "path", UNMATCHED_ROUTE),
+                                  status=status,
+                                  duration=time.perf_counter() - start,
+                                  stats=stats)
+
+
+metrics_registry = MetricsRegistry()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,81 @@
+import hashlib
+from fastapi import Response
+from pydantic import BaseModel
+from typing import Optional
+
+
+__all__ = ["ModelResponse", "make_etag", "etag_matches", "json_with_etag"]
+
+
+class ModelResponse(Response):
+    """
+    JSON ответ из уже проверенной pydantic модели. Сериализуется сразу в
+    pydantic-core через model_dump_json: FastAPI не проверяет модель
+    повторно и не гоняет ее через jsonable_encoder и json.dumps.
+
+    Схему ответа для документации задает response_model у роута
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: BaseModel) -> bytes:
+        return content.model_dump_json().encode()
+
+
+def make_etag(body: bytes) -> str:
+    """
+    Строгий ETag по содержимому тела ответа
+
+    body: bytes
+        Тело ответа
+    """
+
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Совпадает ли ETag с заголовком If-None-Match. Сравнение слабое,
+    как требует RFC 9110 для If-None-Match: префикс W/ не учитывается
+
+    if_none_match: Optional[str]
+        Значение заголовка If-None-Match
+
+    etag: str
+        ETag текущего ответа
+    """
+
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    return any(tag.strip().removeprefix("W/") == etag
+               for tag in if_none_match.split(","))
+
+
+def json_with_etag(body: bytes, if_none_match: Optional[str]) -> Response:
+    """
+    JSON ответ с ETag или пустой 304, если у клиента та же версия
+
+    body: bytes
+        Готовое JSON тело
+
+    if_none_match: Optional[str]
+        Значение заголовка If-None-Match
+    """
+
+    etag = make_etag(body)
+    # Ответ зависит от авторизации: хранить только клиенту и
+    # сверяться с сервером перед каждым использованием
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+if __name__ == "__main__":
+    pass
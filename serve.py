@@ -0,0 +1,245 @@
+"""
+Запуск API в продакшене: несколько воркеров uvicorn на uvloop и httptools
+
+Перед стартом воркеров схема бд создается один раз в главном процессе
+через migrate_db(): недостающие таблицы и индексы добавляются, данные
+не удаляются никогда.
+
+    python serve.py --workers 4 --port 8000
+    python serve.py --workers 4 --preload
+
+--preload импортирует приложение в главном процессе и запускает воркеры
+через fork: импорт и ошибки в нем случаются один раз до старта, память
+с кодом общая, а ключ подписи токенов (если GUDELO_AUTH_SECRET_KEY не
+задан) одинаковый у всех воркеров. Без --preload воркеры запускает сам
+uvicorn, каждый импортирует приложение заново.
+
+Отзыв токенов (auth.revocation_store) по умолчанию хранится в памяти
+процесса: при нескольких воркерах его нужно заменить общим хранилищем
+RevocationStore, иначе отзыв виден только в одном воркере.
+
+С --preload упавший воркер перезапускается с растущей паузой, а если
+воркер не смог запуститься (например, бд недоступна), запуск
+останавливается с кодом 3, как у uvicorn без --preload.
+
+SIGTERM и SIGINT останавливают воркеры мягко: новые соединения не
+принимаются, текущие запросы дорабатываются до --graceful-timeout секунд.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+
+from settings import settings
+from all_models import get_engine, get_shard_engine
+from auth import MemoryRevocationStore, revocation_store
+from work_with_db import migrate_db
+
+
+__all__ = ["APP", "build_parser", "uvicorn_options", "run_preloaded", "main"]
+
+
+APP = "main:app"
+
+# Код завершения воркера, который не смог запуститься (как у uvicorn)
+STARTUP_FAILURE = 3
+
+# Пауза перед перезапуском упавшего воркера: растет вдвое с каждым
+# падением и сбрасывается, если воркер проработал RESTART_RESET_AFTER с
+RESTART_DELAY_MIN = 0.5
+RESTART_DELAY_MAX = 30.0
+RESTART_RESET_AFTER = 60.0
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    "Аргументы командной строки, значения по умолчанию берутся из настроек"
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=settings.server_host)
+    parser.add_argument("--port", type=int, default=settings.server_port)
+    parser.add_argument("--workers", type=int, default=settings.server_workers,
+                        help="количество процессов, 0 - по числу ядер")
+    parser.add_argument("--preload", action="store_true",
+                        help="импортировать приложение до запуска воркеров (fork)")
+    parser.add_argument("--graceful-timeout", type=int,
+                        default=settings.server_graceful_timeout,
+                        help="сколько секунд ждать текущие запросы при остановке")
+    parser.add_argument("--loop", default="uvloop", choices=["uvloop", "asyncio", "auto"])
+    parser.add_argument("--http", default="httptools", choices=["httptools", "h11", "auto"])
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-migrate", action="store_true",
+                        help="не создавать недостающие таблицы и индексы при старте")
+
+    return parser
+
+
+def uvicorn_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Настройки uvicorn из аргументов командной строки
+
+    args: argparse.Namespace
+        Разобранные аргументы
+    """
+
+    return {"host": args.host, "port": args.port, "workers": args.workers,
+            "loop": args.loop, "http": args.http, "log_level": args.log_level,
+            "timeout_graceful_shutdown": args.graceful_timeout}
+
+
+def _spawn_worker(config: uvicorn.Config, sockets: List) -> int:
+    "Запускает воркер через fork и возвращает его pid"
+
+    pid = os.fork()
+
+    if pid == 0:
+        # Сигналы главного процесса воркеру не нужны, uvicorn ставит свои
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+        server = uvicorn.Server(config)
+        status = 1
+
+        try:
+            server.run(sockets=sockets)
+            # started не выставлен - упал lifespan, запросов воркер не принимал
+            status = 0 if server.started else STARTUP_FAILURE
+        except BaseException:
+            logger.exception("Worker [%d] failed", os.getpid())
+        finally:
+            os._exit(status)
+
+    return pid
+
+
+def run_preloaded(args: argparse.Namespace) -> int:
+    """
+    Импортирует приложение в главном процессе, открывает сокет и запускает
+    воркеры через fork. Упавший воркер перезапускается с растущей паузой
+    (от RESTART_DELAY_MIN до RESTART_DELAY_MAX секунд, пауза сбрасывается,
+    если воркер проработал RESTART_RESET_AFTER секунд). Если воркер не
+    смог запуститься (lifespan упал), остальные не запустятся так же:
+    все воркеры останавливаются, возвращается STARTUP_FAILURE. По
+    SIGTERM/SIGINT всем воркерам отправляется SIGTERM и главный процесс
+    ждет их завершения
+
+    args: argparse.Namespace
+        Разобранные аргументы
+
+    return: int
+        Код завершения процесса
+    """
+
+    from main import app
+
+    config = uvicorn.Config(app, **uvicorn_options(args))
+    sockets = [config.bind_socket()]
+    # pid воркера -> время запуска
+    workers: Dict[int, float] = {}
+    # Время, когда можно запустить замену упавшего воркера
+    restarts: List[float] = []
+    restart_delay = RESTART_DELAY_MIN
+    exit_code = 0
+    stopping = False
+
+    def stop(signum: int, frame: Optional[object]) -> None:
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(args.workers):
+        workers[_spawn_worker(config, sockets)] = time.monotonic()
+
+    logger.info("Started parent process [%d] with %d workers", os.getpid(), len(workers))
+
+    while not stopping:
+        now = time.monotonic()
+
+        for due in [due for due in restarts if due <= now]:
+            restarts.remove(due)
+            workers[_spawn_worker(config, sockets)] = now
+
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            if not restarts:
+                break
+            pid = 0
+
+        if pid == 0:
+            time.sleep(0.2)
+            continue
+
+        started_at = workers.pop(pid, now)
+        code = os.waitstatus_to_exitcode(status)
+
+        if stopping:
+            break
+
+        if code == STARTUP_FAILURE:
+            logger.error("Worker [%d] failed to start, stopping", pid)
+            exit_code = STARTUP_FAILURE
+            break
+
+        if now - started_at >= RESTART_RESET_AFTER:
+            restart_delay = RESTART_DELAY_MIN
+
+        logger.warning("Worker [%d] exited with code %d, restarting in %.1f s",
+                       pid, code, restart_delay)
+        restarts.append(now + restart_delay)
+        restart_delay = min(restart_delay * 2, RESTART_DELAY_MAX)
+
+    for pid in workers:
+        os.kill(pid, signal.SIGTERM)
+
+    for pid in workers:
+        os.waitpid(pid, 0)
+
+    logger.info("Stopping parent process [%d]", os.getpid())
+
+    return exit_code
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    args.workers = args.workers or os.cpu_count() or 1
+
+    if not args.no_migrate:
+        migrate_db()
+        # Соединения главного процесса не должны достаться воркерам,
+        # migrate_db открывает и движки шардов
+        get_engine().dispose()
+
+        for shard in range(settings.db_shards):
+            get_shard_engine(shard).dispose()
+
+    if args.workers > 1 and not args.preload and not settings.auth_secret_key:
+        logger.warning("GUDELO_AUTH_SECRET_KEY не задан: у каждого воркера свой ключ "
+                       "подписи, токен работает только в выдавшем его воркере")
+
+    if args.workers > 1 and isinstance(revocation_store, MemoryRevocationStore):
+        logger.warning("Отзыв токенов хранится в памяти процесса: выход и удаление "
+                       "компании не отзывают токены в других воркерах, нужен общий "
+                       "RevocationStore")
+
+    if args.preload and args.workers > 1:
+        return run_preloaded(args)
+
+    # uvicorn.run сам завершает процесс с кодом 3, если приложение не запустилось
+    uvicorn.run(APP, **uvicorn_options(args))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
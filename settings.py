@@ -0,0 +1,127 @@
+import os
+from dotenv import load_dotenv
+from pydantic import BaseModel
+from typing import Literal
+
+
+__all__ = ["ENV_PREFIX", "Settings", "settings"]
+
+
+ENV_PREFIX = "GUDELO_"
+
+
+class Settings(BaseModel):
+    """
+    Настройки приложения. Каждое поле можно переопределить переменной
+    окружения (или строкой в .env) с префиксом GUDELO_ и именем поля
+    в верхнем регистре, например GUDELO_DB_URL
+    """
+
+    # Подключение к бд
+    db_url: str = "sqlite+pysqlite:///data_base_biznes.db"
+    db_async_url: str = "sqlite+aiosqlite:///data_base_biznes.db"
+
+    # Шардирование сотрудников: 0 - сотрудники в основной бд, иначе
+    # Employees компании лежит в файле шарда company_id % db_shards,
+    # в основной бд (каталог) остаются Owners и Companys
+    db_shards: int = 0
+    db_shard_url: str = "sqlite+pysqlite:///data_base_biznes_shard_{shard}.db"
+    db_shard_async_url: str = "sqlite+aiosqlite:///data_base_biznes_shard_{shard}.db"
+
+    # Пул соединений
+    db_pool_class: Literal["queue", "null", "static"] = "queue"
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = -1
+
+    # PRAGMA для SQLite, выполняются на каждом новом соединении
+    sqlite_journal_mode: Literal["DELETE", "TRUNCATE", "PERSIST",
+                                 "MEMORY", "WAL", "OFF"] = "WAL"
+    sqlite_synchronous: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = "NORMAL"
+    sqlite_busy_timeout: int = 5000
+    sqlite_cache_size: int = -64000
+    sqlite_mmap_size: int = 268435456
+    sqlite_foreign_keys: bool = True
+
+    # Запуск через serve.py: адрес, количество воркеров (0 - по числу ядер)
+    # и сколько секунд ждать текущие запросы при остановке
+    server_host: str = "127.0.0.1"
+    server_port: int = 8000
+    server_workers: int = 1
+    server_graceful_timeout: int = 30
+
+    # Кэш чтения компании по владельцу: записей и время жизни в секундах
+    company_cache_size: int = 10_000
+    company_cache_ttl: float = 60.0
+
+    # Склейка одиночных вставок сотрудников в общие транзакции: пачка
+    # уходит в бд, когда набралось rows строк или прошло delay_ms мс.
+    # При 0 пачка уходит сразу, и в нее попадают строки, пришедшие пока
+    # писалась предыдущая: с synchronous=NORMAL ожидание в 5 мс стоит
+    # больше, чем экономит
+    employee_insert_batching: bool = False
+    employee_insert_batch_rows: int = 500
+    employee_insert_batch_delay_ms: float = 0.0
+
+    # Фоновый импорт сотрудников: задач одновременно, максимум задач
+    # в очереди, строк в одной транзакции, сколько завершенных задач
+    # хранить для запросов статуса, пауза между частями в мс, в которую
+    # блокировку записи могут взять обычные запросы, и Retry-After в
+    # секундах для 503 при полной очереди
+    import_job_workers: int = 1
+    import_job_queue_size: int = 100
+    import_job_chunk_rows: int = 1000
+    import_job_history: int = 1000
+    import_job_pause_ms: float = 50.0
+    import_job_retry_after: int = 5
+
+    # Ограничение параллельных запросов по классам роутов (чтение,
+    # запись, массовые, выгрузка, 0 - без ограничения): сверх limit
+    # запросы ждут в очереди до queue_size штук не дольше queue_timeout
+    # секунд, остальным сразу 503 с Retry-After. SQLite пишет по одному,
+    # поэтому бюджет записи маленький. При склейке вставок
+    # POST /create/employee идет в свой бюджет insert: строки ждут в
+    # очереди вставок, и бюджет ограничивает ее размер. Выгрузка держит
+    # соединение пула весь ответ, ее бюджет меньше размера пула
+    admission_read_limit: int = 64
+    admission_write_limit: int = 4
+    admission_bulk_limit: int = 2
+    admission_export_limit: int = 2
+    admission_insert_limit: int = 500
+    admission_queue_size: int = 256
+    admission_queue_timeout: float = 5.0
+    admission_retry_after: int = 1
+
+    # Запросов в секунду на владельца и всплеск сверх них, 0 - без
+    # ограничения. Сверх лимита 429 с Retry-After
+    owner_rate_limit: float = 0.0
+    owner_rate_burst: int = 20
+
+    # Авторизация. Пустой ключ - случайный ключ процесса, для нескольких
+    # воркеров ключ подписи токенов нужно задать явно
+    password_hash_workers: int = 4
+    session_token_ttl: int = 12 * 60 * 60
+    auth_secret_key: str = ""
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        "Собирает настройки из переменных окружения и файла .env"
+
+        load_dotenv()
+
+        values = {}
+        for name in cls.model_fields:
+            env_name = f"{ENV_PREFIX}{name.upper()}"
+
+            if env_name in os.environ:
+                values[name] = os.environ[env_name]
+
+        return cls(**values)
+
+
+settings = Settings.from_env()
+
+
+if __name__ == "__main__":
+    print(settings.model_dump_json(indent=4))
@@ -1,40 +1,26 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import insert, select, func
+from sqlalchemy import DDL, MetaData, Table, delete, inspect, insert, select, func, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateColumn, CreateTable
 from all_models import (
-    engine, Base, Owner, Employee, Company, NewOwnerCreate, CompanyCreate,
+    get_engine, get_shard_engine, get_employees_engine, is_sharded, catalog_tables,
+    shard_metadata, Base, Owner, Employee, Company, EMPLOYEE_COUNT_TRIGGERS,
+    EMPLOYEE_SEARCH_DDL, SHARD_EMPLOYEE_COUNT_DDL, NewOwnerCreate, CompanyCreate,
     CompanyDelete, EmployeeBase, EmployeeMany
     )
 from fastapi import HTTPException
-from hash_fun import convert_text_into_hash
-from typing import Optional
+from hash_fun import verify_password
+from cache import company_cache, owner_cache
+from auth import revocation_store
+from settings import settings
+from typing import List, Optional
 
-__all__ = ["create_db", "clear_db", "insert_owner_in_db", "check_owner_in_db",
+__all__ = ["create_db", "clear_db", "migrate_db", "insert_owner_in_db", "check_owner_in_db",
            "insert_company_in_db", "get_company_by_owner", "delete_company_from_db",
-           "have_count_company_owner", "insert_employee_in_db",
-           "insert_many_employee_in_db", "delete_employee_from_db"]
+           "insert_employee_in_db", "insert_many_employee_in_db", "delete_employee_from_db"]
 
 
-def have_count_company_owner(data_owner: Owner, data_company: CompanyCreate) -> None:
-    """
-    Функция проверяет сколько у владельца компаний, допускаеться владеть 1
-
-    data_owner: Ownre
-        Класс содержащий данные о владельце
-
-    data_company: CompanyCreate
-        Класс содержащий данные для создания компании
-    """
-
-    stmt_select = select(func.count(Company.owner_id)) \
-                  .where(Company.owner_id == data_owner.id)
-
-    with Session(engine) as session:
-        count_company: int = session.scalar(stmt_select) # type: ignore
-
-    if count_company >= 1:
-        raise HTTPException(status_code=400,
-                            detail="У вас уже есть компания")
-
 def insert_owner_in_db(new_user: NewOwnerCreate) -> None:
     """
     Добавление нового владельца в базу данных
@@ -46,7 +32,7 @@ def insert_owner_in_db(new_user: NewOwnerCreate) -> None:
     stmt_insert = insert(Owner).values(name=new_user.name,
                                        password=new_user.password)
     
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         session.add(Owner(name=new_user.name, password=new_user.password))
         session.commit()
 
@@ -54,13 +40,176 @@ def insert_owner_in_db(new_user: NewOwnerCreate) -> None:
 def create_db() -> None:
     "Создаем базу данных"
 
-    Base.metadata.create_all(engine)
+    Base.metadata.create_all(get_engine(), tables=catalog_tables())
+
+    for shard in range(settings.db_shards):
+        shard_metadata.create_all(get_shard_engine(shard))
+
+
+def _migrate_tables(engine: Engine, tables: List[Table]) -> None:
+    """
+    Добавляет недостающие колонки и индексы в существующие таблицы
+
+    engine: Engine
+        Движок бд (основной или шарда)
+
+    tables: List[Table]
+        Таблицы этой бд
+    """
+
+    # create_all не добавляет колонки в уже существующие таблицы
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+
+        for table in tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+
+                column_ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN {column_ddl}'))
+
+                # Счетчик сотрудников в старой бд заполняется один раз
+                if column is Company.__table__.c.employee_count and not is_sharded():
+                    count = select(func.count(Employee.id)) \
+                            .where(Employee.company_id == Company.id) \
+                            .scalar_subquery()
+                    connection.execute(update(Company).values(employee_count=count))
+
+    # create_all пропускает индексы уже существующих таблиц
+    for table in tables:
+        for index in table.indexes:
+            try:
+                with engine.begin() as connection:
+                    index.create(connection, checkfirst=True)
+            except IntegrityError as exc:
+                raise RuntimeError(f"Не удалось создать индекс {index.name}: "
+                                   f"в таблице {table.name} есть дубликаты "
+                                   f"({exc.orig})") from exc
+
+
+def _migrate_employee_ddl(engine: Engine, ddls: List[DDL]) -> None:
+    """
+    Создает триггеры и индекс поиска рядом с Employees. Индекс поиска в
+    старой бд строится один раз по уже записанным именам
+
+    engine: Engine
+        Движок бд, где лежат сотрудники
+
+    ddls: List[DDL]
+        Триггеры счетчика сотрудников этой бд
+    """
+
+    with engine.begin() as connection:
+        has_search = inspect(connection).has_table("employees_fts")
+
+        for ddl in ddls + EMPLOYEE_SEARCH_DDL:
+            connection.execute(ddl)
+
+        if not has_search:
+            connection.execute(text("INSERT INTO employees_fts(employees_fts) VALUES ('rebuild')"))
+
+
+def _migrate_company_autoincrement(engine: Engine) -> None:
+    """
+    Пересоздает Companys со старой схемой с AUTOINCREMENT. Без него SQLite
+    отдает id удаленной последней компании следующей новой, и старый
+    токен или кэш другого воркера с этим company_id видят чужую компанию
+
+    SQLite не меняет первичный ключ через ALTER TABLE, поэтому таблица
+    копируется в новую и подменяет старую. Внешние ключи на время копии
+    выключены: DROP TABLE иначе удалил бы сотрудников каскадом
+
+    engine: Engine
+        Движок основной бд
+    """
+
+    with engine.connect() as connection:
+        if connection.dialect.name != "sqlite":
+            return
+
+        ddl = connection.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (Company.__tablename__,)).scalar()
+
+        if ddl is None or "AUTOINCREMENT" in ddl.upper():
+            return
+
+        # В копии метаданных нужна и Owners: на нее ссылается внешний ключ
+        metadata = MetaData()
+        Owner.__table__.to_metadata(metadata)
+        new_table = Company.__table__.to_metadata(metadata,
+                                                  name=f"{Company.__tablename__}_new")
+        columns = ", ".join(f'"{column.name}"' for column in Company.__table__.columns)
+
+        # PRAGMA foreign_keys не меняется внутри транзакции.
+        # legacy_alter_table: RENAME не проверяет триггеры Employees,
+        # которые ссылаются на Companys, пока ее нет
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        connection.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+
+        try:
+            connection.exec_driver_sql("BEGIN")
+            connection.execute(CreateTable(new_table))
+            connection.exec_driver_sql(f'INSERT INTO "{new_table.name}" ({columns}) '
+                                       f'SELECT {columns} FROM "{Company.__tablename__}"')
+            connection.exec_driver_sql(f'DROP TABLE "{Company.__tablename__}"')
+            connection.exec_driver_sql(f'ALTER TABLE "{new_table.name}" '
+                                       f'RENAME TO "{Company.__tablename__}"')
+
+            for index in Company.__table__.indexes:
+                index.create(connection)
+
+            broken = connection.exec_driver_sql("PRAGMA foreign_key_check").fetchall()
+
+            if broken:
+                raise RuntimeError(f"Нарушены внешние ключи после пересоздания "
+                                   f"{Company.__tablename__}: {broken}")
+
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            connection.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+            connection.exec_driver_sql(
+                f"PRAGMA foreign_keys={'ON' if settings.sqlite_foreign_keys else 'OFF'}")
+
+
+def migrate_db() -> None:
+    """
+    Доводит существующую базу данных (и шарды) до текущих моделей:
+    создает недостающие таблицы, колонки, индексы и триггеры. Данные не
+    удаляются и не переносятся между основной бд и шардами, повторный
+    запуск ничего не меняет
+    """
+
+    Base.metadata.create_all(get_engine(), tables=catalog_tables())
+    _migrate_tables(get_engine(), catalog_tables())
+    _migrate_company_autoincrement(get_engine())
+
+    if not is_sharded():
+        _migrate_employee_ddl(get_engine(), EMPLOYEE_COUNT_TRIGGERS)
+
+    for shard in range(settings.db_shards):
+        shard_metadata.create_all(get_shard_engine(shard))
+        _migrate_tables(get_shard_engine(shard), shard_metadata.sorted_tables)
+        _migrate_employee_ddl(get_shard_engine(shard), SHARD_EMPLOYEE_COUNT_DDL)
 
 
 def clear_db() -> None:
     "Очищаем базу данны"
 
-    Base.metadata.drop_all(engine)
+    Base.metadata.drop_all(get_engine())
+
+    for shard in range(settings.db_shards):
+        shard_metadata.drop_all(get_shard_engine(shard))
+
+    owner_cache.clear()
+    company_cache.clear()
+    revocation_store.clear()
 
 
 def check_owner_in_db(data_owner: str) -> Owner:
@@ -73,11 +222,10 @@ def check_owner_in_db(data_owner: str) -> Owner:
     """
 
     name_ower, password = data_owner.split(":")
-    password_owner = convert_text_into_hash(value=password)
 
     stmt_select_owner = select(Owner).where(Owner.name == name_ower)
 
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         owner_from_db = session.scalar(stmt_select_owner)
 
     # Проверка на наличие владельца в бд
@@ -86,7 +234,7 @@ def check_owner_in_db(data_owner: str) -> Owner:
                             detail="Такого владельца нет")
     
     # Проверяем введенный пароль
-    if owner_from_db.password != password_owner:
+    if not verify_password(password, owner_from_db.password):
         raise HTTPException(status_code=403,
                             detail="Неверный пароль")
     
@@ -106,7 +254,7 @@ def insert_company_in_db(data_company: CompanyCreate, data_owner: Owner) -> None
 
     # Вставка компании в базу данных
 
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         session.add(Company(name=data_company.name, owner_id=data_owner.id))
         session.commit()
 
@@ -121,7 +269,7 @@ def get_company_by_owner(data_owner: Owner) -> Company | None:
     
     stmt_select = select(Company).where(Company.owner_id == data_owner.id)
 
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         company_from_db = session.scalar(stmt_select)
 
     return company_from_db
@@ -142,7 +290,7 @@ def delete_company_from_db(data_company: CompanyDelete, data_owner: Owner) -> No
     stmt_select = select(Company).where(Company.name == data_company.name) \
                                  .where(Company.owner_id == data_owner.id)
     
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         output = session.scalar(stmt_select)
     
         if output is None:
@@ -151,6 +299,11 @@ def delete_company_from_db(data_company: CompanyDelete, data_owner: Owner) -> No
         session.delete(output)
         session.commit()
 
+    # В шарде нет внешнего ключа на Companys, сотрудников удаляем сами
+    if is_sharded():
+        with get_employees_engine(output.id).begin() as connection:
+            connection.execute(delete(Employee).where(Employee.company_id == output.id))
+
 
 def insert_employee_in_db(data_owner: Owner, data_employee: EmployeeBase) -> None:
     """
@@ -166,8 +319,14 @@ def insert_employee_in_db(data_owner: Owner, data_employee: EmployeeBase) -> Non
     # Ищем id компании владельца
     stmt_select = select(Company.id).where(Company.owner_id == data_owner.id)
 
-    with Session(engine) as session:
-        company_id: int = session.scalar(stmt_select) # type: ignore
+    with Session(get_engine()) as session:
+        company_id: Optional[int] = session.scalar(stmt_select)
+
+    if company_id is None:
+        raise HTTPException(status_code=404,
+                            detail="У вас нет компании, куда можно добавить сотрудника")
+
+    with Session(get_employees_engine(company_id)) as session:
         session.add(Employee(name=data_employee.name, company_id=company_id))
         session.commit()
             
@@ -186,7 +345,7 @@ def insert_many_employee_in_db(data_owner: Owner, data_employees: EmployeeMany)
     # Ищем id компании владельца
     stmt_select = select(Company.id).where(Company.owner_id == data_owner.id)
 
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         company_id: Optional[int] = session.scalar(stmt_select) 
 
     # Проверяем что компании существует 
@@ -197,7 +356,7 @@ def insert_many_employee_in_db(data_owner: Owner, data_employees: EmployeeMany)
     list_employees = [Employee(name=i_elem.name, company_id=company_id) 
                       for i_elem in data_employees.array]
     
-    with Session(engine) as session:
+    with Session(get_employees_engine(company_id)) as session:
         session.add_all(list_employees)
         session.commit()
 
@@ -213,22 +372,32 @@ def delete_employee_from_db(data_owner: Owner, data_employee: EmployeeBase) -> N
         Класс содержащий данные о сотрудниках
     """
 
+    # Сотрудники могут лежать в шарде, поэтому без join с Companys
+    stmt_select_company = select(Company.id).where(Company.owner_id == data_owner.id)
+
+    with Session(get_engine()) as session:
+        company_id: Optional[int] = session.scalar(stmt_select_company)
+
+    if company_id is None:
+        raise HTTPException(status_code=404,
+                            detail="У вас нет такого сотрудника")
+
     stmt_select = select(Employee) \
-                    .where(Company.owner_id.has(Company.owner_id == data_owner.id)) \
+                    .where(Employee.company_id == company_id) \
                     .where(Employee.name == data_employee.name)
     
-    with Session(engine) as session:
+    with Session(get_employees_engine(company_id)) as session:
         emp = session.scalar(stmt_select)
 
     if emp is None:
         raise HTTPException(status_code=404,
                             detail="У вас нет такого сотрудника")
     
-    with Session(engine) as session:
+    with Session(get_employees_engine(emp.company_id)) as session:
         session.delete(emp)
         session.commit()
     
 
 
 if __name__ == "__main__":
-    pass
+    migrate_db()
@@ -0,0 +1,1048 @@
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy import delete, distinct, event, func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from all_models import (
+    get_async_engine, get_shard_async_engine, get_employees_async_engine, is_sharded, shard_of,
+    employee_counts, Owner, Employee, Company, NewOwnerCreate, CompanyCreate, CompanyAnswer,
+    CompanyDelete, CompanySummary, EmployeeNameCount, EmployeeBase, EmployeeMany,
+    EmployeeDeleteMany, EmployeeAnswer, EmployeeSearchAnswer, employees_fts,
+    BatchCreateEmployee, BatchCreateEmployees, BatchDeleteEmployee, BatchDeleteEmployees,
+    BatchGetCompanySummary, BatchOperation, BatchRequest, BatchResult, BatchAnswer
+    )
+from fastapi import HTTPException
+from hash_fun import hash_password_async, needs_rehash, verify_password_async
+from cache import company_cache, owner_cache
+from auth import OwnerIdentity, revocation_store, token_signer
+from settings import settings
+from write_queue import InsertQueue
+from import_jobs import ImportJob, ImportJobQueue
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, Callable, List, Optional, Set, Tuple
+import asyncio
+import logging
+import sys
+
+__all__ = ["async_session", "employee_insert_queues", "insert_owner_in_db", "check_owner_in_db",
+           "authenticate_owner", "login_owner",
+           "insert_company_in_db", "get_company_by_owner", "get_company_json_by_owner",
+           "get_company_summary",
+           "delete_company_from_db",
+           "insert_employee_in_db",
+           "insert_many_employee_in_db", "insert_stream_employee_in_db",
+           "insert_employee_chunk_in_db", "employee_import_jobs", "submit_employee_import",
+           "delete_employee_from_db", "delete_many_employee_from_db",
+           "get_employees_by_owner", "export_employees_by_owner",
+           "search_employees_by_owner", "execute_batch", "wait_shard_cleanups"]
+
+
+# Фабрика асинхронных сессий. expire_on_commit=False чтобы объекты
+# оставались читаемыми после commit без повторного запроса в бд.
+# Движок передается при открытии сессии: async_session(bind=get_async_engine())
+async_session = async_sessionmaker(expire_on_commit=False)
+
+NO_COMPANY_FOR_EMPLOYEE = "У вас нет компании, куда можно добавить сотрудника"
+
+logger = logging.getLogger("uvicorn.error")
+
+# Фоновые удаления сотрудников из шардов после удаления компании
+_shard_cleanups: Set[asyncio.Task] = set()
+
+# Ключ в session.info, под которым лежит общая сессия шарда пакета
+SHARD_SESSION_KEY = "shard_session"
+
+# Токенизатор trigram находит только строки от 3 символов
+SEARCH_MIN_FTS_LENGTH = 3
+
+# Одиночные вставки сотрудников из разных запросов пишутся пачками,
+# если включено GUDELO_EMPLOYEE_INSERT_BATCHING. По очереди на бд с
+# сотрудниками: одна без шардирования, иначе по одной на шард
+employee_insert_queues = [
+    InsertQueue(Employee.__table__,
+                max_rows=settings.employee_insert_batch_rows,
+                max_delay=settings.employee_insert_batch_delay_ms / 1000,
+                enabled=settings.employee_insert_batching,
+                engine=partial(get_shard_async_engine, shard) if is_sharded() else get_async_engine)
+    for shard in range(max(settings.db_shards, 1))]
+
+
+def _employee_insert_queue(company_id: int) -> InsertQueue:
+    "Очередь вставок бд, где лежат сотрудники компании"
+
+    return employee_insert_queues[shard_of(company_id) if is_sharded() else 0]
+
+
+@asynccontextmanager
+async def _employees_session(session: AsyncSession, company_id: int) -> AsyncIterator[AsyncSession]:
+    """
+    Сессия для запросов к Employees компании. Без шардирования это сессия
+    запроса, все идет одной транзакцией. С шардированием - сессия бд
+    шарда со своей транзакцией, она фиксируется на выходе из блока, до
+    commit сессии запроса
+
+    session: AsyncSession
+        Сессия запроса
+
+    company_id: int
+        id компании
+    """
+
+    if not is_sharded():
+        yield session
+        return
+
+    # Пакет операций держит одну сессию шарда на все операции
+    shard_session = session.info.get(SHARD_SESSION_KEY)
+
+    if shard_session is not None:
+        yield shard_session
+        return
+
+    async with async_session(bind=get_employees_async_engine(company_id)) as shard_session, \
+               shard_session.begin():
+        yield shard_session
+
+
+async def _check_company_exists(session: AsyncSession, company_id: int) -> None:
+    """
+    В шарде нет внешнего ключа на Companys, и он не отклонит вставку в уже
+    удаленную компанию (например по старому токену). С шардированием
+    компания проверяется в основной бд, без него - проверка не нужна
+
+    session: AsyncSession
+        Сессия запроса
+
+    company_id: int
+        id компании
+    """
+
+    if not is_sharded():
+        return
+
+    if await session.scalar(select(Company.id).where(Company.id == company_id)) is None:
+        raise HTTPException(status_code=404,
+                            detail=NO_COMPANY_FOR_EMPLOYEE)
+
+
+def _after_commit(session: AsyncSession, callback: Callable[[], None]) -> None:
+    """
+    Выполняет callback только после commit транзакции запроса. Пока
+    транзакция не зафиксирована, сбрасывать кэши рано: другой запрос
+    успеет положить туда старые данные, а при откате сброс не нужен
+
+    session: AsyncSession
+        Сессия запроса
+
+    callback: Callable[[], None]
+        Что выполнить после commit
+    """
+
+    event.listen(session.sync_session, "after_commit",
+                 lambda _: callback(), once=True)
+
+
+def _forget_owner(session: AsyncSession, owner_id: int) -> None:
+    """
+    После commit сбрасывает владельца и его компанию из кэшей
+    и отзывает его старые токены
+    """
+
+    def forget() -> None:
+        owner_cache.invalidate_owner(owner_id)
+        company_cache.invalidate_owner(owner_id)
+        revocation_store.revoke_owner(owner_id)
+
+    _after_commit(session, forget)
+
+
+def _detached_copy(owner: Owner) -> Owner:
+    """
+    Копия владельца (вместе с компанией) вне сессии для кэша. Сам объект
+    из сессии класть в кэш нельзя: откат транзакции запроса сбрасывает
+    (expire) его атрибуты, и следующий запрос пошел бы за ними в бд
+
+    owner: Owner
+        Владелец, загруженный в сессии запроса
+    """
+
+    company = None
+
+    if owner.company is not None:
+        company = Company(id=owner.company.id, name=owner.company.name,
+                          owner_id=owner.company.owner_id)
+        make_transient_to_detached(company)
+
+    owner_copy = Owner(id=owner.id, name=owner.name, password=owner.password)
+    make_transient_to_detached(owner_copy)
+    set_committed_value(owner_copy, "company", company)
+
+    return owner_copy
+
+
+async def insert_owner_in_db(session: AsyncSession, new_user: NewOwnerCreate) -> None:
+    """
+    Добавление нового владельца в базу данных
+
+    session: AsyncSession
+        Сессия запроса
+
+    new_user: NewOwnerCreate
+        Класс с далнными для создания нового владельца
+    """
+
+    stmt_insert = insert(Owner).values(name=new_user.name,
+                                       password=new_user.password)
+
+    # Уникальность имени проверяет сама бд, отдельный SELECT не нужен
+    try:
+        await session.execute(stmt_insert)
+    except IntegrityError:
+        raise HTTPException(status_code=401,
+                            detail="Такой владелец уже существует")
+
+
+async def authenticate_owner(session: AsyncSession, name: str, password: str) -> Owner:
+    """
+    Функция проверяет имя и пароль владельца. Пароль проверяется в пуле
+    потоков, хеши старого формата (sha256) заменяются на scrypt
+
+    session: AsyncSession
+        Сессия запроса
+
+    name: str
+        Имя владельца
+
+    password: str
+        Пароль в открытом виде
+    """
+
+    stmt_select_owner = select(Owner).where(Owner.name == name)
+
+    owner_from_db = await session.scalar(stmt_select_owner)
+
+    # Проверка на наличие владельца в бд
+    if owner_from_db is None:
+        raise HTTPException(status_code=401,
+                            detail="Такого владельца нет")
+
+    # Проверяем введенный пароль
+    if not await verify_password_async(password, owner_from_db.password):
+        raise HTTPException(status_code=403,
+                            detail="Неверный пароль")
+
+    # Пароль верный, значит можно прозрачно перехешировать старый хеш.
+    # Владелец привязан к сессии, UPDATE уйдет вместе с commit запроса
+    if needs_rehash(owner_from_db.password):
+        owner_from_db.password = await hash_password_async(password)
+
+    return owner_from_db
+
+
+async def check_owner_in_db(session: AsyncSession, data_owner: str) -> Owner:
+    """
+    Функция проверяет заголовок авторизации 'имя:пароль' и возвращает владельца,
+    привязанного к сессии запроса
+
+    session: AsyncSession
+        Сессия запроса
+
+    data_owner: str
+        Значение заголовка Authorization
+    """
+
+    # Уже проверенные данные авторизации не проверяем повторно. Владелец
+    # из кэша привязывается к сессии без запроса в бд
+    owner_from_cache = owner_cache.get(data_owner)
+
+    if owner_from_cache is not None:
+        return await session.merge(owner_from_cache, load=False)
+
+    name_owner, _, password = data_owner.partition(":")
+    owner_from_db = await authenticate_owner(session, name=name_owner, password=password)
+
+    owner_cache.set(data_owner, _detached_copy(owner_from_db))
+
+    return owner_from_db
+
+
+async def login_owner(session: AsyncSession, name: str, password: str) -> str:
+    """
+    Функция проверяет пароль владельца и выдает подписанный токен
+    с id владельца и id его компании
+
+    session: AsyncSession
+        Сессия запроса
+
+    name: str
+        Имя владельца
+
+    password: str
+        Пароль в открытом виде
+    """
+
+    owner = await authenticate_owner(session, name=name, password=password)
+
+    return token_signer.issue(owner_id=owner.id, company_id=owner.company_id)
+
+
+async def insert_company_in_db(session: AsyncSession, data_company: CompanyCreate,
+                               data_owner: OwnerIdentity) -> None:
+    """
+    Функця добавляет компанию в базу данных, тем кто прислал ее
+
+    session: AsyncSession
+        Сессия запроса
+
+    data_company: CompanyCreate
+        Класс содержащий данные о компании
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+    """
+
+    stmt_insert = insert(Company).values(name=data_company.name,
+                                         owner_id=data_owner.id)
+
+    # Одна компания на владельца и уникальность имени проверяются
+    # уникальными индексами в бд
+    try:
+        await session.execute(stmt_insert)
+    except IntegrityError as exc:
+        if "Companys.owner_id" in str(exc.orig):
+            raise HTTPException(status_code=400,
+                                detail="У вас уже есть компания")
+
+        raise HTTPException(status_code=401,
+                            detail="Такая компания уже существует")
+
+    # У владельца в кэше и в выданных токенах лежит старая компания
+    _forget_owner(session, data_owner.id)
+
+
+async def get_company_by_owner(session: AsyncSession,
+                               data_owner: OwnerIdentity) -> Company | None:
+    """
+    Функция выполняет поиск компании по владельцу
+
+    session: AsyncSession
+        Сессия запроса
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+    """
+
+    stmt_select = select(Company).where(Company.owner_id == data_owner.id)
+
+    return await session.scalar(stmt_select)
+
+
+async def get_company_json_by_owner(session: AsyncSession,
+                                    data_owner: OwnerIdentity) -> Optional[bytes]:
+    """
+    Функция возвращает JSON компании владельца (CompanyAnswer) через кэш
+    чтения: в бд идет только при промахе. None - у владельца нет компании
+
+    session: AsyncSession
+        Сессия запроса
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+    """
+
+    body = company_cache.get(data_owner.id)
+
+    if body is not None:
+        return body
+
+    company = await get_company_by_owner(session, data_owner=data_owner)
+
+    if company is None:
+        return None
+
+    body = CompanyAnswer.model_validate(company).model_dump_json().encode()
+    company_cache.set(data_owner.id, body)
+
+    return body
+
+
+async def get_company_summary(session: AsyncSession, data_owner: OwnerIdentity,
+                              top: int) -> CompanySummary:
+    """
+    Функция собирает сводку по сотрудникам компании владельца. Количество
+    сотрудников читается из счетчика Companys.employee_count за O(1),
+    остальное считается COUNT/GROUP BY по индексу (company_id, name)
+    без загрузки самих сотрудников
+
+    session: AsyncSession
+        Сессия запроса
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+
+    top: int
+        Сколько самых частых имен вернуть
+    """
+
+    company_id = _get_company_id(data_owner)
+
+    stmt_company = select(Company.id, Company.name, Company.employee_count) \
+                    .where(Company.id == company_id)
+
+    # В шарде счетчик лежит рядом с сотрудниками, в employee_counts
+    stmt_count = select(employee_counts.c.employee_count) \
+                    .where(employee_counts.c.company_id == company_id)
+
+    stmt_distinct = select(func.count(distinct(Employee.name))) \
+                    .where(Employee.company_id == company_id)
+
+    name_count = func.count().label("count")
+    stmt_top = select(Employee.name, name_count) \
+                    .where(Employee.company_id == company_id) \
+                    .group_by(Employee.name) \
+                    .order_by(name_count.desc(), Employee.name) \
+                    .limit(top)
+
+    company = (await session.execute(stmt_company)).one_or_none()
+
+    # Компанию могли удалить после выдачи токена
+    if company is None:
+        raise HTTPException(status_code=404,
+                            detail="Компании по этому владельцу нету")
+
+    async with _employees_session(session, company_id) as employees:
+        employee_count = company.employee_count
+
+        if is_sharded():
+            employee_count = await employees.scalar(stmt_count) or 0
+
+        top_names = [] if top == 0 else [
+            EmployeeNameCount(name=name, count=count)
+            for name, count in await employees.execute(stmt_top)]
+
+        distinct_names = await employees.scalar(stmt_distinct)
+
+    return CompanySummary(id=company.id, name=company.name,
+                          employee_count=employee_count,
+                          distinct_names=distinct_names,
+                          top_names=top_names)
+
+
+async def delete_company_from_db(session: AsyncSession, data_company: CompanyDelete,
+                                 data_owner: OwnerIdentity) -> None:
+    """
+    Функция удаляет компанию из базы данных, проверяет что пришел запрос от
+    того кто владеет ей
+
+    session: AsyncSession
+        Сессия запроса
+
+    data_company: CompanyDelete
+        Класс содержащий данные о компании
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+    """
+
+    # Удаляем только компанию владельца, сотрудники удалятся
+    # внешним ключом с ondelete="CASCADE", а в шарде - отдельным DELETE
+    stmt_delete = delete(Company).where(Company.name == data_company.name) \
+                                 .where(Company.owner_id == data_owner.id) \
+                                 .returning(Company.id)
+
+    stmt_select = select(Company.id).where(Company.name == data_company.name)
+
+    company_id = await session.scalar(stmt_delete)
+
+    # Второй запрос только на ошибке, чтобы отличить чужую компанию
+    # от несуществующей
+    if company_id is None:
+        if await session.scalar(stmt_select) is None:
+            raise HTTPException(status_code=404,
+                                detail="Такой компании не существует")
+
+        raise HTTPException(status_code=400,
+                            detail="Это не ваша компания")
+
+    # Сотрудники в шарде удаляются только после commit: если удаление
+    # компании откатится, они должны остаться
+    if is_sharded():
+        _after_commit(session, partial(_schedule_shard_cleanup, company_id))
+
+    _forget_owner(session, data_owner.id)
+
+
+async def _delete_shard_employees(company_id: int) -> None:
+    "Удаляет сотрудников и счетчик удаленной компании из ее шарда"
+
+    try:
+        async with async_session(bind=get_employees_async_engine(company_id)) as employees, \
+                   employees.begin():
+            await employees.execute(delete(Employee).where(Employee.company_id == company_id))
+            await employees.execute(delete(employee_counts)
+                                    .where(employee_counts.c.company_id == company_id))
+    except Exception:
+        # id компаний не переиспользуются, оставшиеся строки никому не видны
+        logger.exception("Не удалось удалить сотрудников компании %d из шарда", company_id)
+
+
+def _schedule_shard_cleanup(company_id: int) -> None:
+    "Запускает удаление сотрудников из шарда фоновой задачей"
+
+    task = asyncio.get_running_loop().create_task(_delete_shard_employees(company_id))
+    _shard_cleanups.add(task)
+    task.add_done_callback(_shard_cleanups.discard)
+
+
+async def wait_shard_cleanups() -> None:
+    "Дожидается начатых удалений сотрудников из шардов (при остановке)"
+
+    await asyncio.gather(*_shard_cleanups)
+
+
+def _get_company_id(data_owner: OwnerIdentity,
+                    detail: str = "Компании по этому владельцу нету") -> int:
+    """
+    Возвращает id компании владельца без запроса в бд: из токена или из
+    owner.company, загруженной при авторизации по паролю
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+
+    detail: str
+        Текст ошибки 404, если компании нет
+    """
+
+    if data_owner.company_id is None:
+        raise HTTPException(status_code=404, detail=detail)
+
+    return data_owner.company_id
+
+
+async def insert_employee_in_db(session: AsyncSession, data_owner: OwnerIdentity,
+                                data_employee: EmployeeBase) -> None:
+    """
+    Функция добавляет сотрудника в базу данных. При включенной склейке
+    вставка идет через очередь вставок в общей с другими запросами
+    транзакции, а не в транзакции запроса
+
+    session: AsyncSession
+        Сессия запроса
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+
+    data_employee: EmployeeBase
+        Класс содержащий данные о сотруднике
+    """
+
+    company_id = _get_company_id(data_owner, detail=NO_COMPANY_FOR_EMPLOYEE)
+    await _check_company_exists(session, company_id)
+    queue = _employee_insert_queue(company_id)
+
+    # Внешний ключ не даст вставить сотрудника в уже удаленную компанию
+    try:
+        if queue.enabled:
+            await queue.put({"name": data_employee.name, "company_id": company_id})
+        else:
+            async with _employees_session(session, company_id) as employees:
+                await employees.execute(insert(Employee).values(name=data_employee.name,
+                                                                company_id=company_id))
+    except IntegrityError:
+        raise HTTPException(status_code=404,
+                            detail=NO_COMPANY_FOR_EMPLOYEE)
+
+
+async def insert_many_employee_in_db(session: AsyncSession, data_owner: OwnerIdentity,
+                                     data_employees: EmployeeMany) -> None:
+    """
+    Функция выполняет множественную вставку сотрудников в бд
+
+    session: AsyncSession
+        Сессия запроса
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+
+    data_employees: EmployeeMany
+        Класс содержащий данные о сотрудниках
+    """
+
+    company_id = _get_company_id(data_owner, detail=NO_COMPANY_FOR_EMPLOYEE)
+
+    if not data_employees.array:
+        return
+
+    await _insert_employee_names(session, company_id,
+                                 names=[i_elem.name for i_elem in data_employees.array])
+
+
+async def _insert_employee_names(session: AsyncSession, company_id: int,
+                                 names: List[str]) -> None:
+    "Core insert имен сотрудников одним executemany без ORM объектов"
+
+    await _check_company_exists(session, company_id)
+
+    try:
+        async with _employees_session(session, company_id) as employees:
+            await employees.execute(insert(Employee),
+                                    [{"name": name, "company_id": company_id}
+                                     for name in names])
+    except IntegrityError:
+        raise HTTPException(status_code=404,
+                            detail=NO_COMPANY_FOR_EMPLOYEE)
+
+
+async def insert_employee_chunk_in_db(company_id: int, names: List[str]) -> None:
+    """
+    Функция вставляет часть фонового импорта в своей сессии и транзакции,
+    вне HTTP запроса
+
+    company_id: int
+        id компании, куда добавляются сотрудники
+
+    names: List[str]
+        Имена сотрудников
+    """
+
+    async with async_session(bind=get_async_engine()) as session, session.begin():
+        await _insert_employee_names(session, company_id, names=names)
+
+
+# Большие импорты выполняются в фоне частями, роут только ставит задачу
+employee_import_jobs = ImportJobQueue(insert_employee_chunk_in_db,
+                                      workers=settings.import_job_workers,
+                                      max_queued=settings.import_job_queue_size,
+                                      chunk_rows=settings.import_job_chunk_rows,
+                                      history=settings.import_job_history,
+                                      pause=settings.import_job_pause_ms / 1000,
+                                      retry_after=settings.import_job_retry_after)
+
+
+def submit_employee_import(data_owner: OwnerIdentity, data_employees: EmployeeMany) -> ImportJob:
+    """
+    Функция ставит добавление сотрудников в очередь фонового импорта
+    и сразу возвращает задачу
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+
+    data_employees: EmployeeMany
+        Класс содержащий данные о сотрудниках
+
+    return: ImportJob
+        Задача импорта, ее статус отдает employee_import_jobs.get
+    """
+
+    company_id = _get_company_id(data_owner, detail=NO_COMPANY_FOR_EMPLOYEE)
+
+    return employee_import_jobs.submit(owner_id=data_owner.id, company_id=company_id,
+                                       names=[i_elem.name for i_elem in data_employees.array])
+
+
+async def insert_stream_employee_in_db(session: AsyncSession, data_owner: OwnerIdentity,
+                                       batches: AsyncIterator[List[str]]) -> int:
+    """
+    Функция выполняет потоковую вставку сотрудников пачками через Core insert
+    (executemany) в транзакции запроса, ORM объекты не создаются
+
+    session: AsyncSession
+        Сессия запроса
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+
+    batches: AsyncIterator[List[str]]
+        Поток пачек имен сотрудников
+
+    return: int
+        Сколько сотрудников добавлено
+    """
+
+    company_id = _get_company_id(data_owner, detail=NO_COMPANY_FOR_EMPLOYEE)
+    await _check_company_exists(session, company_id)
+    stmt_insert = insert(Employee)
+    count = 0
+
+    try:
+        async with _employees_session(session, company_id) as employees:
+            async for batch in batches:
+                await employees.execute(stmt_insert,
+                                        [{"name": name, "company_id": company_id}
+                                         for name in batch])
+                count += len(batch)
+    except IntegrityError:
+        raise HTTPException(status_code=404,
+                            detail=NO_COMPANY_FOR_EMPLOYEE)
+
+    return count
+
+
+async def delete_employee_from_db(session: AsyncSession, data_owner: OwnerIdentity,
+                                  data_employee: EmployeeBase) -> None:
+    """
+    Функция проверяет что работник относиться к компании владель и удаляет его
+
+    session: AsyncSession
+        Сессия запроса
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+
+    data_employee: EmployeeBase
+        Класс содержащий данные о сотруднике
+    """
+
+    company_id = _get_company_id(data_owner)
+
+    # Удаляется один сотрудник с таким именем из компании владельца
+    stmt_select = select(Employee.id) \
+                    .where(Employee.company_id == company_id) \
+                    .where(Employee.name == data_employee.name) \
+                    .limit(1) \
+                    .scalar_subquery()
+
+    stmt_delete = delete(Employee).where(Employee.id == stmt_select) \
+                                  .returning(Employee.id)
+
+    async with _employees_session(session, company_id) as employees:
+        employee_id = await employees.scalar(stmt_delete)
+
+    if employee_id is None:
+        raise HTTPException(status_code=404,
+                            detail="У вас нет такого сотрудника")
+
+
+async def delete_many_employee_from_db(session: AsyncSession, data_owner: OwnerIdentity,
+                                       data_employees: EmployeeDeleteMany) -> int:
+    """
+    Функция удаляет сотрудников компании владельца по списку имен и/или id
+    одним DELETE
+
+    session: AsyncSession
+        Сессия запроса
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+
+    data_employees: EmployeeDeleteMany
+        Класс содержащий имена и id сотрудников
+
+    return: int
+        Сколько сотрудников удалено
+    """
+
+    company_id = _get_company_id(data_owner)
+
+    stmt_delete = delete(Employee) \
+                    .where(Employee.company_id == company_id) \
+                    .where(or_(Employee.name.in_(data_employees.names),
+                               Employee.id.in_(data_employees.ids)))
+
+    async with _employees_session(session, company_id) as employees:
+        result = await employees.execute(stmt_delete)
+
+    return result.rowcount
+
+
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+    """
+    Наименьшая строка больше всех строк, начинающихся с prefix. Последний
+    символ Unicode (U+10FFFF) в конце prefix увеличить нельзя, он
+    отбрасывается; None - prefix состоит только из таких символов, и
+    сверху диапазон не ограничен
+
+    prefix: str
+        Начало имени сотрудника
+    """
+
+    stripped = prefix.rstrip(chr(sys.maxunicode))
+
+    if not stripped:
+        return None
+
+    code = ord(stripped[-1]) + 1
+
+    # Суррогаты не кодируются в UTF-8, следующий за U+D7FF символ - U+E000
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000
+
+    return stripped[:-1] + chr(code)
+
+
+async def get_employees_by_owner(data_owner: OwnerIdentity,
+                                 after_id: int = 0,
+                                 limit: int = 100,
+                                 prefix: Optional[str] = None
+                                 ) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Функция возвращает страницу сотрудников компании владельца по курсору:
+    сотрудники с id больше after_id в порядке возрастания id. Строки
+    отдаются потоком из курсора, список в памяти не собирается
+
+    Ответ читается уже после того, как сессия запроса закрыта,
+    поэтому поток открывает свою сессию
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+
+    after_id: int
+        id последнего сотрудника с предыдущей страницы
+
+    limit: int
+        Размер страницы
+
+    prefix: Optional[str]
+        Начало имени сотрудника (с учетом регистра)
+    """
+
+    company_id = _get_company_id(data_owner)
+
+    stmt_select = select(Employee.id, Employee.name) \
+                    .where(Employee.company_id == company_id) \
+                    .where(Employee.id > after_id) \
+                    .order_by(Employee.id) \
+                    .limit(limit)
+
+    # Диапазон вместо LIKE: LIKE в SQLite без учета регистра и не идет по индексу
+    if prefix:
+        stmt_select = stmt_select.where(Employee.name >= prefix)
+        upper_bound = _prefix_upper_bound(prefix)
+
+        if upper_bound is not None:
+            stmt_select = stmt_select.where(Employee.name < upper_bound)
+
+    async def rows() -> AsyncIterator[Tuple[int, str]]:
+        async with async_session(bind=get_employees_async_engine(company_id)) as session:
+            result = await session.stream(stmt_select)
+
+            async for employee_id, name in result:
+                yield employee_id, name
+
+    return rows()
+
+
+async def export_employees_by_owner(data_owner: OwnerIdentity,
+                                    batch_size: int) -> AsyncIterator[List[Tuple[int, str]]]:
+    """
+    Функция отдает всех сотрудников компании владельца пачками по
+    batch_size строк в порядке id. Строки читаются из курсора по мере
+    отправки (yield_per), в памяти держится только одна пачка, сколько бы
+    сотрудников ни было в компании
+
+    Как и у get_employees_by_owner, поток открывает свою сессию: он
+    читается после того, как сессия запроса закрыта
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+
+    batch_size: int
+        Сколько строк читать из курсора за раз
+    """
+
+    company_id = _get_company_id(data_owner)
+
+    stmt_select = select(Employee.id, Employee.name) \
+                    .where(Employee.company_id == company_id) \
+                    .order_by(Employee.id) \
+                    .execution_options(yield_per=batch_size)
+
+    async def batches() -> AsyncIterator[List[Tuple[int, str]]]:
+        async with async_session(bind=get_employees_async_engine(company_id)) as session:
+            result = await session.stream(stmt_select)
+
+            async for partition in result.partitions():
+                yield partition # type: ignore
+
+    return batches()
+
+
+async def search_employees_by_owner(session: AsyncSession, data_owner: OwnerIdentity,
+                                    query: str, limit: int) -> EmployeeSearchAnswer:
+    """
+    Функция ищет сотрудников компании владельца по подстроке имени без
+    учета регистра. От 3 символов поиск идет по индексу FTS5
+    (employees_fts), лучшие по bm25 первыми. Более короткая строка ищется
+    через LIKE только среди сотрудников компании (индекс по company_id).
+    LIKE не различает регистр только у ASCII, поэтому имя и строка
+    сравниваются после casefold (функция соединения SQLite): "ле" находит
+    и "Лена"
+
+    session: AsyncSession
+        Сессия запроса
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+
+    query: str
+        Подстрока имени
+
+    limit: int
+        Сколько сотрудников вернуть
+    """
+
+    company_id = _get_company_id(data_owner)
+
+    if len(query) >= SEARCH_MIN_FTS_LENGTH:
+        # Строка целиком в кавычках - фраза, а не синтаксис запроса FTS5
+        phrase = '"' + query.replace('"', '""') + '"'
+        stmt_select = select(employees_fts.c.rowid, employees_fts.c.name) \
+                        .where(employees_fts.c.name.match(phrase)) \
+                        .where(employees_fts.c.company_id == company_id) \
+                        .order_by(employees_fts.c.rank, employees_fts.c.rowid) \
+                        .limit(limit)
+    else:
+        stmt_select = select(Employee.id, Employee.name) \
+                        .where(Employee.company_id == company_id) \
+                        .where(func.casefold(Employee.name)
+                               .contains(query.casefold(), autoescape=True)) \
+                        .order_by(Employee.id) \
+                        .limit(limit)
+
+    async with _employees_session(session, company_id) as employees:
+        rows = await employees.execute(stmt_select)
+
+    return EmployeeSearchAnswer(items=[EmployeeAnswer(id=employee_id, name=name)
+                                       for employee_id, name in rows])
+
+
+async def _begin_transaction(session: AsyncSession, immediate: bool) -> None:
+    """
+    Явно открывает транзакцию сессии в SQLite. Драйвер (pysqlite,
+    aiosqlite) сам пишет BEGIN только перед INSERT/UPDATE/DELETE, и если
+    первым идет SAVEPOINT, то его RELEASE сразу фиксирует изменения:
+    откат транзакции запроса их уже не отменит
+
+    session: AsyncSession
+        Сессия, в которой нужна транзакция
+
+    immediate: bool
+        Сразу взять блокировку записи. Транзакция, которая сначала читает,
+        а потом пишет, получает "database is locked" без ожидания
+        busy_timeout, если между ее чтением и записью писал другой запрос
+    """
+
+    connection = await session.connection()
+
+    if connection.dialect.name != "sqlite":
+        return
+
+    raw_connection = await connection.get_raw_connection()
+
+    if not raw_connection.driver_connection.in_transaction: # type: ignore
+        await connection.exec_driver_sql("BEGIN IMMEDIATE" if immediate else "BEGIN")
+
+
+async def _run_batch_operation(session: AsyncSession, data_owner: OwnerIdentity,
+                               operation: BatchOperation) -> BatchResult:
+    "Выполняет одну операцию пакета той же функцией, что и ее роут"
+
+    if isinstance(operation, BatchCreateEmployee):
+        # Не через очередь вставок: она пишет в своей транзакции
+        await insert_many_employee_in_db(session, data_owner=data_owner,
+                                         data_employees=EmployeeMany(array=[operation]))
+        return BatchResult(status=201)
+
+    if isinstance(operation, BatchCreateEmployees):
+        await insert_many_employee_in_db(session, data_owner=data_owner,
+                                         data_employees=operation)
+        return BatchResult(status=201, result={"inserted": len(operation.array)})
+
+    if isinstance(operation, BatchDeleteEmployee):
+        await delete_employee_from_db(session, data_owner=data_owner,
+                                      data_employee=operation)
+        return BatchResult(status=201)
+
+    if isinstance(operation, BatchDeleteEmployees):
+        count = await delete_many_employee_from_db(session, data_owner=data_owner,
+                                                   data_employees=operation)
+        return BatchResult(status=200, result={"deleted": count})
+
+    if isinstance(operation, BatchGetCompanySummary):
+        summary = await get_company_summary(session, data_owner=data_owner,
+                                            top=operation.top)
+        return BatchResult(status=200, result=summary)
+
+    # Из бд, а не из кэша: видны изменения предыдущих операций пакета
+    company = await get_company_by_owner(session, data_owner=data_owner)
+
+    if company is None:
+        raise HTTPException(status_code=404,
+                            detail="Компании по этому владельцу нету")
+
+    return BatchResult(status=200, result=CompanyAnswer.model_validate(company))
+
+
+async def _execute_batch(session: AsyncSession, employees: AsyncSession,
+                         data_owner: OwnerIdentity, data_batch: BatchRequest) -> BatchAnswer:
+    "Операции пакета по порядку, SAVEPOINT - в сессии, куда пишутся сотрудники"
+
+    writes = any(isinstance(operation, (BatchCreateEmployee, BatchCreateEmployees,
+                                        BatchDeleteEmployee, BatchDeleteEmployees))
+                 for operation in data_batch.operations)
+    await _begin_transaction(employees, immediate=writes)
+    results: List[BatchResult] = []
+
+    for index, operation in enumerate(data_batch.operations):
+        if data_batch.mode == "atomic":
+            try:
+                results.append(await _run_batch_operation(session, data_owner, operation))
+            except HTTPException as exc:
+                raise HTTPException(status_code=exc.status_code,
+                                    detail=f"Операция {index}: {exc.detail}",
+                                    headers=exc.headers)
+            continue
+
+        try:
+            async with employees.begin_nested():
+                result = await _run_batch_operation(session, data_owner, operation)
+        except HTTPException as exc:
+            result = BatchResult(status=exc.status_code, detail=str(exc.detail))
+
+        results.append(result)
+
+    return BatchAnswer(results=results)
+
+
+async def execute_batch(session: AsyncSession, data_owner: OwnerIdentity,
+                        data_batch: BatchRequest) -> BatchAnswer:
+    """
+    Функция выполняет операции пакета по порядку в одной транзакции.
+    В режиме atomic ошибка операции откатывает весь пакет и возвращается
+    ошибкой с номером операции. В режиме independent каждая операция
+    идет в своем SAVEPOINT: ошибка откатывает только ее и попадает в ее
+    результат, остальные фиксируются вместе одним commit
+
+    Все операции пакета касаются компании владельца, поэтому при
+    шардировании они идут в одной транзакции ее шарда, а в основной бд
+    только читают
+
+    session: AsyncSession
+        Сессия запроса
+
+    data_owner: OwnerIdentity
+        Класс содержащий данные о владельце
+
+    data_batch: BatchRequest
+        Класс содержащий режим и операции пакета
+
+    return: BatchAnswer
+        Результаты операций в том же порядке
+    """
+
+    if not is_sharded() or data_owner.company_id is None:
+        return await _execute_batch(session, session, data_owner, data_batch)
+
+    async with async_session(bind=get_employees_async_engine(data_owner.company_id)) \
+            as shard_session, shard_session.begin():
+        session.info[SHARD_SESSION_KEY] = shard_session
+
+        try:
+            return await _execute_batch(session, shard_session, data_owner, data_batch)
+        finally:
+            del session.info[SHARD_SESSION_KEY]
+
+
+if __name__ == "__main__":
+    pass
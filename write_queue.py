@@ -0,0 +1,194 @@
+import asyncio
+from sqlalchemy import Table, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from all_models import get_async_engine
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+__all__ = ["InsertQueue"]
+
+
+Row = Dict[str, Any]
+
+
+class InsertQueue:
+    """
+    Очередь вставок, которая склеивает одиночные INSERT из разных запросов
+    в одну транзакцию: строки копятся до max_rows штук или max_delay секунд
+    с первой строки, потом уходят в бд одним executemany и одним commit.
+    Вызывающий ждет, пока его строка будет записана
+
+    Фоновая задача запускается в lifespan приложения через start() или
+    сама на первой вставке. Соединение у задачи свое на все время работы:
+    запросы ждут записи, держа соединения пула, и если бы задача брала
+    соединение из пула на каждую пачку, при нагрузке его могло не остаться
+
+    table: Table
+        Таблица, куда идут вставки
+
+    max_rows: int
+        Максимум строк в одной транзакции
+
+    max_delay: float
+        Сколько секунд ждать остальные строки после первой
+
+    enabled: bool
+        Включена ли склейка, иначе очередь не используется
+
+    engine: Callable[[], AsyncEngine]
+        Движок бд с таблицей (например движок шарда)
+    """
+
+    def __init__(self, table: Table, max_rows: int, max_delay: float,
+                 enabled: bool = False,
+                 engine: Callable[[], AsyncEngine] = get_async_engine) -> None:
+        self.table = table
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.enabled = enabled
+        self.engine = engine
+        self._pending: List[Tuple[Row, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Future] = None
+        self._closing = False
+
+    async def start(self) -> None:
+        """
+        Запускает фоновую задачу в текущем event loop и ждет, пока она
+        получит соединение с бд
+        """
+
+        loop = asyncio.get_running_loop()
+
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._ready = loop.create_future()
+            self._closing = False
+            self._task = loop.create_task(self._run(), name="insert-queue")
+
+        await asyncio.shield(self._ready)
+
+    async def stop(self) -> None:
+        """
+        Записывает то, что осталось в очереди, и останавливает фоновую
+        задачу. Задача не отменяется посреди записи, иначе часть строк
+        могла бы записаться без ответа вызывающему
+        """
+
+        if self._task is None or self._task.done():
+            return
+
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    async def put(self, row: Row) -> None:
+        """
+        Ставит строку в очередь и ждет ее записи. Ошибка записи именно
+        этой строки (например IntegrityError) поднимается здесь
+
+        row: Row
+            Значения колонок
+        """
+
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((row, future))
+
+        # Будим задачу на первой строке (начать отсчет max_delay)
+        # и когда набралась полная пачка
+        if len(self._pending) == 1 or len(self._pending) >= self.max_rows:
+            self._wakeup.set()
+
+        await future
+
+    async def _run(self) -> None:
+        try:
+            async with self.engine().connect() as connection:
+                self._ready.set_result(None)
+                await self._serve(connection)
+        except Exception as exc:
+            # Без задачи ответа никто не дождется
+            if not self._ready.done():
+                self._ready.set_exception(exc)
+
+            for _, future in self._pending:
+                if not future.done():
+                    future.set_exception(exc)
+            self._pending = []
+
+    async def _serve(self, connection: AsyncConnection) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            deadline = loop.time() + self.max_delay
+
+            while len(self._pending) < self.max_rows and not self._closing:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+                self._wakeup.clear()
+
+            batch, self._pending = self._pending[:self.max_rows], self._pending[self.max_rows:]
+
+            if batch:
+                await self._flush(connection, batch)
+
+            if self._pending:
+                self._wakeup.set()
+            elif self._closing:
+                return
+
+    async def _flush(self, connection: AsyncConnection,
+                     batch: List[Tuple[Row, asyncio.Future]]) -> None:
+        stmt_insert = insert(self.table)
+        failed: Dict[int, BaseException] = {}
+
+        try:
+            async with connection.begin():
+                await connection.execute(stmt_insert, [row for row, _ in batch])
+        except IntegrityError:
+            # Одна плохая строка не должна ронять всю пачку: повторяем по
+            # одной в одной транзакции. В SQLite ошибка ограничения
+            # откатывает только свой оператор, транзакция продолжается
+            try:
+                failed = await self._flush_one_by_one(connection, batch)
+            except Exception as exc:
+                failed = {index: exc for index in range(len(batch))}
+        except Exception as exc:
+            failed = {index: exc for index in range(len(batch))}
+
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+
+            if index in failed:
+                future.set_exception(failed[index])
+            else:
+                future.set_result(None)
+
+    async def _flush_one_by_one(self, connection: AsyncConnection,
+                                batch: List[Tuple[Row, asyncio.Future]]
+                                ) -> Dict[int, BaseException]:
+        stmt_insert = insert(self.table)
+        failed: Dict[int, BaseException] = {}
+
+        async with connection.begin():
+            for index, (row, _) in enumerate(batch):
+                try:
+                    await connection.execute(stmt_insert, row)
+                except IntegrityError as exc:
+                    failed[index] = exc
+
+        return failed
+
+
+if __name__ == "__main__":
+    pass